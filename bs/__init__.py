@@ -1,21 +1,93 @@
 
+import importlib
 import os
-import shutil
+
+from bs import snapshot
+
+__version__ = '0.1.0'
+
+_stats = {}
+_scanned = set()
+_STALE = object()
+
+def stat(path):
+    '''Get the (cached) `os.stat` result for a path, or None if it does not exist.
+
+    Files in directories that have been `scan`ned are served from the cache; anything else is stat'ed once and
+    remembered until it is `invalidate`d.
+    '''
+    key = os.path.normpath(path)
+    result = _stats.get(key, _STALE)
+    if result is _STALE:
+        if key not in _stats and os.path.dirname(key) in _scanned:
+            return None
+        try:
+            result = os.stat(key)
+        except OSError:
+            result = None
+        _stats[key] = result
+    return result
+
+def scan(*directories):
+    '''Fill the stat cache with one pass over each directory that has not been scanned yet'''
+    for directory in directories:
+        directory = os.path.normpath(directory or '.')
+        scanned_key = '' if directory == '.' else directory
+        if scanned_key in _scanned:
+            continue
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        _scanned.add(scanned_key)
+        for entry in entries:
+            key = os.path.normpath(entry.path)
+            if key in _stats:
+                continue
+            if not entry.is_file():
+                # directories and the like are stat'ed on demand
+                _stats[key] = _STALE
+                continue
+            try:
+                _stats[key] = entry.stat()
+            except OSError:
+                _stats[key] = None
+
+def invalidate(path):
+    '''Forget the cached stat of a path, call this after writing or removing the file'''
+    _stats[os.path.normpath(path)] = _STALE
+
+def clear_stats():
+    _stats.clear()
+    _scanned.clear()
 
 def get_mtime(path):
-    try:
-        return os.path.getmtime(path)
-    except:
+    result = stat(path)
+    if result is None:
         # the file does not exist (yet?)
         return -1
+    return result.st_mtime
 
 def copy(source, destination):
+    import shutil
+    # import here, the scheduler is only needed once the objectives are evaluated
+    from bs import graph
+    from bs import scheduler
+    snapshot.record(copy, source, destination)
+    if scheduler.DRY_RUN:
+        graph.current.copies.append((source, destination))
+        return
     if os.path.exists(source):
         if get_mtime(destination) < get_mtime(source):
             print('copying {} -> {}'.format(source, destination))
             shutil.copy(source, destination)
+            invalidate(destination)
+
+def __getattr__(name):
+    # the objectives (`bs.Executable`, ...) are imported on first use, so that e.g. `bs --version` does not need them
+    if name.startswith('__'):
+        raise AttributeError(name)
+    return getattr(importlib.import_module('bs.targets'), name)
 
-from bs.targets import *
-        
 
 
@@ -2,18 +2,22 @@
 import argparse
 import sys
 
-# these imports are necessary in order to get the configurations set up
-from bs import objectives
-from bs import compilers_and_linkers
-from bs import builders
-from bs import actions
-from bs import config
-from bs import logger
+import bs
 
 command = sys.argv[1] if len(sys.argv) >= 2 else 'build'
 
+if command in ('--version', '-V'):
+    print('bs {}'.format(bs.__version__))
+    exit(0)
+
+# only the modules of the requested action are imported, see `actions.ACTIONS`
+from bs import actions
+from bs import config
+from bs import trace
+
 # load the current user configuration
-config.load()
+with trace.span('load configuration'):
+    config.load()
 
 # actions:
 #  config
@@ -21,27 +25,10 @@ config.load()
 #  init -- covered by config
 #  start
 
-acts = dict()
-for act_class in [actions.Config, actions.Build, actions.AddObjective, actions.Clean, actions.Demo]:
-    action = act_class()
-    if action.name in acts:
-        logger.internal_error('an action with the name `{}` already exists.\n'
-                'Both `{}` and `{}` have the same command name, one needs to be changed or removed',
-                acts[action.name].__class__, action_class)
-    acts[action.name] = action
-for action in  builders.get_actions() + compilers_and_linkers.get_actions():
-    if action.name in acts:
-        logger.internal_error('an action with the name `{}` already exists.\n'
-                'Both `{}` and `{}` have the same command name, one needs to be changed or removed',
-                acts[action.name].__class__, action_class)
-    acts[action.name] = action
-
-
-try:
-    action = acts[command]
-except KeyError:
+action = actions.find(command)
+if action is None:
     print('error: did not recognize action `{}`, available options are:'.format(command))
-    for action in acts.values():
+    for action in actions.all_actions():
         print('  {:<15} {}'.format(action.name, action.description))
     exit(1)
 
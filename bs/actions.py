@@ -1,11 +1,91 @@
 from __future__ import absolute_import, print_function
 
-import inspect
+import collections
+import importlib
 import os
 import shutil
 
 from bs import config
-from bs import objectives
+from bs import logger
+from bs import scheduler
+from bs import snapshot
+from bs import state
+from bs import targets
+from bs import timings
+from bs import trace
+
+
+def evaluate_objectives(use_snapshot=True):
+    '''Evaluate the objectives file, or replay its snapshot if neither it nor the configuration changed'''
+    inputs = [targets.OBJECTIVES_FILE, config.CONFIG_NAME]
+    if use_snapshot:
+        with trace.span('replay objectives snapshot'):
+            replayed = snapshot.replay(*inputs)
+        if replayed:
+            return
+        # a snapshot that could not be replayed may have scheduled some of the objectives already
+        scheduler.forget()
+        snapshot.start()
+    # everything the objectives file builds is built as a single graph, once it has been evaluated
+    with scheduler.batch():
+        with trace.span('evaluate objectives'):
+            exec(compile(open(targets.OBJECTIVES_FILE).read(), targets.OBJECTIVES_FILE, 'exec'))
+    snapshot.save(*inputs)
+
+
+def walk_objectives():
+    '''Evaluate the objectives file without building anything, leaving what would be built in `graph.current`'''
+    scheduler.DRY_RUN = True
+    try:
+        evaluate_objectives(False)
+    finally:
+        scheduler.DRY_RUN = False
+
+
+ACTIONS = collections.OrderedDict([
+    ('config', 'bs.actions'),
+    ('build', 'bs.actions'),
+    ('add', 'bs.actions'),
+    ('clean', 'bs.actions'),
+    ('gc', 'bs.actions'),
+    ('demo', 'bs.actions'),
+    ('add-builder', 'bs.builders'),
+    ('remove-builder', 'bs.builders'),
+    ('add-compiler', 'bs.compilers_and_linkers'),
+    ('modify-compiler', 'bs.compilers_and_linkers'),
+    ('remove-compiler', 'bs.compilers_and_linkers'),
+    ('add-linker', 'bs.compilers_and_linkers'),
+    ('modify-linker', 'bs.compilers_and_linkers'),
+    ('remove-linker', 'bs.compilers_and_linkers'),
+    ('cache', 'bs.cache'),
+    ('watch', 'bs.watch'),
+    ('worker', 'bs.distributed'),
+    ('generate-ninja', 'bs.ninja'),
+])
+'''The module of every action, so that only the module of the requested action needs to be imported'''
+
+
+def find(name):
+    '''Get the action with a name, or None if there is no such action'''
+    if name not in ACTIONS:
+        return None
+    for action in importlib.import_module(ACTIONS[name]).get_actions():
+        if action.name == name:
+            return action
+    logger.internal_error('the action `{}` is not defined in `{}`', name, ACTIONS[name])
+
+
+def all_actions():
+    '''Get every action, importing all of the modules that define actions'''
+    acts = collections.OrderedDict()
+    for module in collections.OrderedDict.fromkeys(ACTIONS.values()):
+        for action in importlib.import_module(module).get_actions():
+            if action.name in acts:
+                logger.internal_error('an action with the name `{}` already exists.\n'
+                        'Both `{}` and `{}` have the same command name, one needs to be changed or removed',
+                        action.name, acts[action.name].__class__, action.__class__)
+            acts[action.name] = action
+    return list(acts.values())
 
 
 class Action(object):
@@ -69,10 +149,11 @@ class AddObjective(Action):
                 'add',
                 'add an objective, really just adds some scaffolding; '
                 'you will probably need to update the objectives file')
-        self.objectives = {m[0].lower():m[1] for m in inspect.getmembers(objectives, inspect.isclass)
-                if not m[0].startswith('_')}
 
     def add_arguments(self, parser):
+        import inspect
+        self.objectives = {m[0].lower():m[1] for m in inspect.getmembers(targets, inspect.isclass)
+                if not m[0].startswith('_')}
         parser.add_argument('objective_type',
                 help='type of the objective',
                 type=str,
@@ -88,7 +169,7 @@ class AddObjective(Action):
 
     def invoke(self, args):
         o = self.objectives[args.objective_type](args.name, args.sources)
-        objectives.save()
+        targets.save()
 
 
 class Build(Action):
@@ -114,15 +195,43 @@ class Build(Action):
         parser.add_argument('--debug', '-d',
                 help='use the debug compiler (and configuration)',
                 action='store_true')
+        scheduler.add_arguments(parser)
+        parser.add_argument('--keep-going', '-k',
+                help='keep building objectives that do not depend on a failed objective',
+                action='store_true')
+        parser.add_argument('--no-snapshot',
+                help='evaluate the objectives file even if it and the configuration did not change, e.g. when it '
+                    'globs for sources',
+                action='store_true')
+        parser.add_argument('--trace',
+                help='write a timeline of the build to a Chrome trace-event file, for Perfetto or chrome://tracing',
+                metavar='PATH')
 
     def invoke(self, args):
         # import here to prevent recursive import error
+        from bs import cache
         from bs import compilers_and_linkers
         compilers_and_linkers.LIST = args.list
         compilers_and_linkers.GRAPH = args.graph
         compilers_and_linkers.LIST_ALL = args.all
         compilers_and_linkers.FLATTEN = args.flatten
-        exec(compile(open(objectives.OBJECTIVES_FILE).read(), objectives.OBJECTIVES_FILE, 'exec'))
+        scheduler.configure(args)
+        scheduler.KEEP_GOING = args.keep_going
+        trace.ENABLED = bool(args.trace)
+        scheduler.open_log()
+        try:
+            evaluate_objectives(not (args.list or args.graph or args.flatten or args.no_snapshot))
+        finally:
+            scheduler.close_log()
+            with trace.span('save state'):
+                state.database.save()
+                timings.log.save()
+                cache.finish()
+            if args.trace:
+                trace.save(args.trace)
+        if scheduler.failed:
+            logger.error('{} objective(s) could not be built:\n  {}',
+                    len(scheduler.failed), '\n  '.join(item.output for item in scheduler.failed))
 
 class Clean(Action):
 
@@ -135,8 +244,49 @@ class Clean(Action):
         pass
 
     def invoke(self, args):
+        if state.database.built_files():
+            print('removed {} files'.format(remove_built_files(state.database.built_files())))
+            return
+        # built before the manifest existed, find the outputs by evaluating the objectives
         # import here to prevent recursive import error
         from bs import compilers_and_linkers
         compilers_and_linkers.CLEAN = True
-        exec(compile(open(objectives.OBJECTIVES_FILE).read(), objectives.OBJECTIVES_FILE, 'exec'))
+        exec(compile(open(targets.OBJECTIVES_FILE).read(), targets.OBJECTIVES_FILE, 'exec'))
+
 
+class CollectGarbage(Action):
+
+    def __init__(self):
+        Action.__init__(self,
+                'gc',
+                'remove the files that were built for objectives that are no longer in the objectives file')
+
+    def invoke(self, args):
+        walk_objectives()
+        from bs import graph
+        known = set(os.path.normpath(item.output) for item in graph.current.nodes + targets.instances
+                if item.output is not None)
+        orphans = [path for path, owner in state.database.built_files().items()
+                if os.path.normpath(owner) not in known]
+        for path in orphans:
+            print('removing {}'.format(path))
+        print('removed {} files'.format(remove_built_files(orphans)))
+
+
+def remove_built_files(paths):
+    '''Remove files from the manifest of the state database, returns how many of them existed'''
+    removed = 0
+    for path in sorted(paths):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            # already removed
+            pass
+        state.database.forget(path)
+    state.database.save()
+    return removed
+
+
+def get_actions():
+    return [Config(), Build(), AddObjective(), Clean(), CollectGarbage(), Demo()]
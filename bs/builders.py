@@ -1,15 +1,10 @@
 from __future__ import absolute_import
 
-import os
-import subprocess
-import traceback
-
-import yaml
-
 from bs import actions
 from bs import config
-from bs import objectives
+from bs import targets
 from bs import logger
+from bs import scheduler
 
 instances = {}
 '''Instances of builder objects'''
@@ -30,6 +25,7 @@ class Builder(object):
         self.function = function
         self.linker = None
         self.compiler = None
+        self.pool = None
         global instances
         instances[function] = self
 
@@ -37,12 +33,12 @@ class Builder(object):
         return '<{} {}>'.format(self.__class__.__name__, self.function)
 
     def build(self, objective):
-
-        for item in objective.flattened_dependencies():
-            if isinstance(item, objectives.Object):
-                self.compiler.run(item)
-            elif isinstance(item, objectives.LinkedObject):
-                self.linker.run(item)
+        with scheduler.batch():
+            for item in objective.flattened_dependencies():
+                if isinstance(item, targets.Object):
+                    self.compiler.run(item, self.pool)
+                elif isinstance(item, targets.LinkedObject):
+                    self.linker.run(item, self.pool)
 
 
 class Add(actions.Action):
@@ -56,9 +52,12 @@ class Add(actions.Action):
     def add_arguments(self, parser):
         parser.add_argument('function',
                 help='function of the builder')
+        parser.add_argument('--pool',
+                help='pool of every command of this builder, instead of the pools of its compiler and linker')
 
     def invoke(self, args):
         builder = Builder(args.function)
+        builder.pool = args.pool
         config.save()
 
 
@@ -80,6 +79,8 @@ def get_actions():
 
 def save(stream):
     '''Save the compilers info into a YAML stream'''
+    # import here, yaml is slow to import and only needed to save the configuration
+    import yaml
     global instances
     # Convert everything into a dictionay so that it is not saved as weird YAML/python objects
     if instances:
@@ -90,6 +91,8 @@ def save(stream):
                 subdata['linker.function'] = builder.linker.function
             if builder.compiler:
                 subdata['compiler.function'] = builder.compiler.function
+            if builder.pool:
+                subdata['pool'] = builder.pool
         data = { 'builders' : data }
         stream.write(yaml.dump(data, default_flow_style=False))
 
@@ -107,6 +110,8 @@ def load(config_dict):
             builder.compiler = compilers_and_linkers.get_compiler(builder_params.get('compiler.function',
                 builder_function))
             builder.linker = compilers_and_linkers.get_linker(builder_params.get('linker.function', builder_function))
+            builder.pool = builder_params.get('pool')
 
 
-
+if config.loaded is not None:
+    load(config.loaded)
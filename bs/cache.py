@@ -0,0 +1,280 @@
+'''Local, content-addressed cache of compiled objects.
+
+A compiler with `cache` enabled looks up each object it is about to compile by a key made of the compiler identity,
+the command line and the contents of the source and headers. Hits are restored with a hardlink (or a copy) instead of
+running the compiler.
+
+Like ccache's direct mode, the headers do not need to be known up front: a manifest keyed by the command and the
+source lists which headers, with which contents, each cached object was compiled with. Those headers are hashed again
+before an entry of the manifest is used.
+'''
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from bs import actions
+from bs import config
+from bs import logger
+
+DIR = config.ConfigItem('--cache-dir', os.path.join(os.path.expanduser('~'), '.cache', 'bs'),
+        'directory of the compilation cache')
+
+SIZE = config.ConfigItem('--cache-size', '5G', 'maximum size of the compilation cache, e.g. 500M or 5G')
+
+_lock = threading.Lock()
+_counts = {'hits': 0, 'misses': 0, 'stored': 0}
+_identities = {}
+
+
+def parse_size(text):
+    '''Convert a size such as `500M` or `5G` to bytes'''
+    text = str(text).strip().upper()
+    factor = 1
+    for suffix, suffix_factor in [('K', 1 << 10), ('M', 1 << 20), ('G', 1 << 30), ('T', 1 << 40)]:
+        if text.endswith(suffix):
+            text = text[:-1]
+            factor = suffix_factor
+            break
+    try:
+        return int(float(text) * factor)
+    except ValueError:
+        logger.error('could not understand the size `{}`, expected something like 500M or 5G', text)
+
+
+def compiler_identity(command):
+    '''Identify a compiler executable by its resolved path, size and modification time'''
+    try:
+        return _identities[command]
+    except KeyError:
+        pass
+    path = shutil.which(command) or command
+    try:
+        st = os.stat(path)
+        identity = '{}:{}:{}'.format(os.path.realpath(path), st.st_size, st.st_mtime)
+    except OSError:
+        identity = command
+    _identities[command] = identity
+    return identity
+
+
+def key(*parts):
+    hasher = hashlib.md5()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        hasher.update(part)
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def _entry_dir(entry_key):
+    return os.path.join(DIR.value, entry_key[:2], entry_key)
+
+
+def lookup(entry_key, output):
+    '''Restore the cached output for a key, returning the dependencies stored with it, or None on a miss'''
+    entry = _entry_dir(entry_key)
+    cached = os.path.join(entry, 'output')
+    try:
+        with open(os.path.join(entry, 'deps'), 'r') as stream:
+            deps = stream.read().splitlines()
+    except (IOError, OSError):
+        with _lock:
+            _counts['misses'] += 1
+        return None
+    if os.path.exists(output):
+        os.remove(output)
+    try:
+        os.link(cached, output)
+    except OSError:
+        try:
+            shutil.copy2(cached, output)
+        except (IOError, OSError):
+            with _lock:
+                _counts['misses'] += 1
+            return None
+    # the entry directory's mtime is its last use, for LRU eviction
+    try:
+        os.utime(entry, None)
+    except OSError:
+        pass
+    with _lock:
+        _counts['hits'] += 1
+    return deps
+
+
+def store(entry_key, output, deps):
+    '''Copy a freshly built output into the cache along with its discovered dependencies'''
+    entry = _entry_dir(entry_key)
+    if os.path.exists(entry):
+        return
+    parent = os.path.dirname(entry)
+    temp = None
+    try:
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        temp = tempfile.mkdtemp(dir=parent)
+        shutil.copy2(output, os.path.join(temp, 'output'))
+        with open(os.path.join(temp, 'deps'), 'w') as stream:
+            stream.write(''.join(dep + '\n' for dep in deps))
+        os.rename(temp, entry)
+    except (IOError, OSError):
+        # another process stored it first, or the cache is not writable; either way this is not fatal
+        if temp is not None:
+            shutil.rmtree(temp, ignore_errors=True)
+        return
+    with _lock:
+        _counts['stored'] += 1
+
+
+MANIFEST_ENTRIES = 16
+'''Sets of header contents remembered per manifest, the oldest ones are forgotten first'''
+
+
+def find(manifest_key, digest):
+    '''Get the key of the entry of a manifest whose dependencies still have the same contents, or None.
+
+    A manifest is keyed by what is known without the dependencies (e.g. the command and the digest of the source), and
+    lists for each entry the (path, digest) of the dependencies it was built with; `digest(path)` hashes them again.
+    '''
+    entry = _entry_dir(manifest_key)
+    try:
+        with open(os.path.join(entry, 'manifest'), 'r') as stream:
+            manifest = json.load(stream)
+    except (IOError, OSError, ValueError):
+        return None
+    for deps, entry_key in reversed(manifest):
+        if all((digest(path) or '') == path_digest for path, path_digest in deps):
+            try:
+                os.utime(entry, None)
+            except OSError:
+                pass
+            return entry_key
+    return None
+
+
+def remember(manifest_key, deps, entry_key):
+    '''Add the entry `entry_key`, built with the dependencies `deps` [(path, digest), ...], to a manifest'''
+    entry = _entry_dir(manifest_key)
+    path = os.path.join(entry, 'manifest')
+    deps = [list(dep) for dep in deps]
+    with _lock:
+        try:
+            with open(path, 'r') as stream:
+                manifest = json.load(stream)
+        except (IOError, OSError, ValueError):
+            manifest = []
+        if [deps, entry_key] in manifest:
+            return
+        manifest = (manifest + [[deps, entry_key]])[-MANIFEST_ENTRIES:]
+        try:
+            if not os.path.exists(entry):
+                os.makedirs(entry)
+            temp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'w') as stream:
+                json.dump(manifest, stream)
+            os.replace(temp_path, path)
+        except (IOError, OSError):
+            # the cache is not writable, which is not fatal
+            pass
+
+
+def _entries():
+    root = DIR.value
+    if not os.path.isdir(root):
+        return
+    for prefix in os.listdir(root):
+        prefix_dir = os.path.join(root, prefix)
+        if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+            continue
+        for name in os.listdir(prefix_dir):
+            entry = os.path.join(prefix_dir, name)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, ff)) for ff in os.listdir(entry))
+                yield os.path.getmtime(entry), size, entry
+            except OSError:
+                continue
+
+
+def trim():
+    '''Evict the least recently used entries until the cache is within its size limit'''
+    limit = parse_size(SIZE.value)
+    entries = sorted(_entries())
+    total = sum(size for _mtime, size, _entry in entries)
+    for _mtime, size, entry in entries:
+        if total <= limit:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def _stats_path():
+    return os.path.join(DIR.value, 'stats.json')
+
+
+def read_stats():
+    try:
+        with open(_stats_path(), 'r') as stream:
+            return json.load(stream)
+    except (IOError, OSError, ValueError):
+        return {'hits': 0, 'misses': 0, 'stored': 0}
+
+
+def finish():
+    '''Save the counters of this invocation and evict old entries if anything was stored'''
+    if not any(_counts.values()):
+        return
+    stats = read_stats()
+    for name, count in _counts.items():
+        stats[name] = stats.get(name, 0) + count
+    try:
+        if not os.path.exists(DIR.value):
+            os.makedirs(DIR.value)
+        with open(_stats_path(), 'w') as stream:
+            json.dump(stats, stream)
+    except (IOError, OSError):
+        pass
+    if _counts['stored']:
+        trim()
+    for name in _counts:
+        _counts[name] = 0
+
+
+class Cache(actions.Action):
+
+    def __init__(self):
+        actions.Action.__init__(self,
+                'cache',
+                'Show statistics of, or clear, the compilation cache')
+
+    def add_arguments(self, parser):
+        parser.add_argument('operation',
+                choices=['stats', 'clear'],
+                help='`stats` prints the size and hit rate of the cache, `clear` removes every entry')
+
+    def invoke(self, args):
+        if args.operation == 'clear':
+            for _mtime, _size, entry in list(_entries()):
+                shutil.rmtree(entry, ignore_errors=True)
+            if os.path.exists(_stats_path()):
+                os.remove(_stats_path())
+            print('cleared {}'.format(DIR.value))
+            return
+        entries = list(_entries())
+        stats = read_stats()
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        print('cache directory  {}'.format(DIR.value))
+        print('entries          {}'.format(len(entries)))
+        print('size             {:.1f} MB of {}'.format(sum(ee[1] for ee in entries) / float(1 << 20), SIZE.value))
+        print('hits             {}'.format(stats.get('hits', 0)))
+        print('misses           {}'.format(stats.get('misses', 0)))
+        print('hit rate         {:.1f}%'.format(100.0 * stats.get('hits', 0) / lookups if lookups else 0.0))
+
+
+def get_actions():
+    return [Cache()]
@@ -1,19 +1,26 @@
 from __future__ import absolute_import, print_function
 
 import os
-import subprocess
-import traceback
-
-import yaml
+import threading
 
+import bs
 from bs import actions
+from bs import cache
 from bs import config
-from bs import objectives
+from bs import depfile
+from bs import graph
+from bs import targets
 from bs import logger
+from bs import scheduler
+from bs import state
 
 compilers = {}
 linkers = {}
 
+_batch_lock = threading.Lock()
+_batch_outputs = set()
+'''Objects in the working directory that a batched compile is writing'''
+
 LIST = False
 LIST_ALL = False
 FLATTEN = False
@@ -21,6 +28,8 @@ GRAPH = False
 DEBUG = False
 CLEAN = False
 
+_cleaned = set()
+
 def get_compiler(function):
     try:
         return compilers[function]
@@ -41,6 +50,11 @@ def get_linker(function):
         
         
 
+def _configured(compiler, function):
+    '''Get a compiler or linker of the configuration, raises KeyError if there is none with that function'''
+    return (compilers if compiler else linkers)[function]
+
+
 class CMDThing(object):
 
     def __init__(self, function, command):
@@ -51,16 +65,23 @@ class CMDThing(object):
         self.paths = []
         self.path_switch = ''
         self.output_switch = ''
+        self.pool = None
         self.instances[function] = self
 
     def __repr__(self):
         return '<{} {}>'.format(self.__class__.__name__, self.command)
 
-    def run(self, objective):
+    def __reduce__(self):
+        # snapshots refer to the compiler or linker of the configuration when they are replayed, see `snapshot`
+        return _configured, (self.instances is compilers, self.function)
+
+    def run(self, objective, pool=None):
+        '''Build an objective and everything it depends on, counting the commands towards `pool` (see `--pools`)
+        instead of the pool of this compiler or linker'''
         if LIST:
             print(objective)
             for item in objective:
-                if LIST_ALL or not isinstance(item, objectives.Object):
+                if LIST_ALL or not isinstance(item, targets.Object):
                     print('    {}'.format(item))
         if GRAPH:
             raise NotImplementedError
@@ -73,47 +94,381 @@ class CMDThing(object):
 
         if CLEAN:
             for item in objective.flattened_dependencies():
-                if not isinstance(item, objectives.Source) and os.path.exists(item.output):
-                    print('removing {}'.format(item.output))
-                    os.remove(item.output)
+                node = graph.current.add(item)
+                if node in _cleaned:
+                    continue
+                _cleaned.add(node)
+                if isinstance(item, targets.Source):
+                    continue
+                for path in [item.output] + ([item.stub] if isinstance(item, targets.PrecompiledHeader) else []):
+                    if bs.stat(path) is not None:
+                        print('removing {}'.format(path))
+                        os.remove(path)
+                        bs.invalidate(path)
             return
 
         if not LIST and not GRAPH and not FLATTEN:
-            full_cmd = [self.command] + self.options
-            for pp in self.paths:
-                full_cmd.append('{}{}'.format(self.path_switch, pp))
-
             for item in objective.flattened_dependencies():
-                if item.needs_updating:
-                    output_dir = os.path.dirname(item.output)
-                    if not os.path.exists(output_dir):
-                        os.makedirs(output_dir)
-                    specific_command = list(full_cmd)
-                    for dep in item:
-                        specific_command.append(dep.output)
-                    specific_command.append('{}{}'.format(self.output_switch, item.output))
-                    specific_command.extend(self.post_options)
-                    print('{}'.format(' '.join(specific_command)))
-                    try:
-                        subprocess.check_call(specific_command)
-                    except subprocess.CalledProcessError:
-                        logger.error('subprocess call failed')
+                if not isinstance(item, targets.Source):
+                    scheduler.schedule(item, self, pool)
+            scheduler.flush()
+
+    def batch_key(self, item):
+        '''Objectives with the same key can be built by a single command, see `Compiler.batch_key`'''
+        return None
+
+    def command_for(self, item):
+        '''Get the command that builds `item`'''
+        specific_command = [self.command] + self.options
+        for pp in self.paths:
+            specific_command.append('{}{}'.format(self.path_switch, pp))
+        for dep in item:
+            if not isinstance(dep, targets.PrecompiledHeader):
+                # precompiled headers are included with the `pch_switch` of the compiler
+                specific_command.append(dep.output)
+        specific_command.append('{}{}'.format(self.output_switch, item.output))
+        specific_command.extend(self.post_options)
+        return specific_command
+
+    def execute(self, item, command):
+        '''Run the command that builds `item`, returns True if it succeeded. This is called from a worker thread.'''
+        return scheduler.call(command)
+
+    def finish(self, item):
+        '''Called after `item` was built successfully'''
+        pass
 
 
 class Compiler(CMDThing):
 
     instances = compilers
 
+    def __init__(self, function, command):
+        CMDThing.__init__(self, function, command)
+        self.depfile_options = []
+        self.cache = False
+        self.preprocess_options = ['-E']
+        self.batch_size = 0
+        self.batch_options = []
+        self.batch_output_ext = '.o'
+        self.pch_switch = '-include'
+        self.distributed = False
+
+    def command_for(self, item):
+        specific_command = CMDThing.command_for(self, item)
+        if self.depfile_options and isinstance(item, targets.Object):
+            specific_command.extend(self.depfile_options)
+            specific_command.append(item.depfile)
+        if isinstance(item, targets.Object) and item.precompiled_header is not None:
+            specific_command.extend([self.pch_switch, item.precompiled_header.stub])
+        return specific_command
+
+    def execute(self, item, command):
+        if isinstance(item, targets.PrecompiledHeader):
+            item[0].write()
+        if not self.cache or not isinstance(item, targets.Object):
+            return self._compile(item, command)
+        restored, pending = self._cache_lookup(item, command)
+        if restored:
+            return True
+        if not self._compile(item, command):
+            return False
+        self._cache_store(item, pending)
+        return True
+
+    def _cache_lookup(self, item, command):
+        '''Restore `item` from the cache, returns whether it was restored and what `_cache_store` needs otherwise'''
+        generic_command = [arg.replace(item.output, '<output>') for arg in command]
+        manifest_key = self._direct_cache_key(item, generic_command) if self.depfile_options else None
+        cache_key = None
+        deps = None
+        if manifest_key is not None:
+            cache_key = cache.find(manifest_key, state.database.digest)
+            if cache_key is not None:
+                deps = cache.lookup(cache_key, item.output)
+        if deps is None:
+            cache_key = self._preprocessed_cache_key(item, generic_command)
+            if cache_key is not None:
+                deps = cache.lookup(cache_key, item.output)
+                if deps is not None and manifest_key is not None:
+                    # next time, the headers it was compiled with are checked without preprocessing
+                    cache.remember(manifest_key, self._manifest(deps), cache_key)
+        if deps is not None:
+            if self.depfile_options:
+                state.database.set_discovered_deps(item.output, deps)
+            return True, None
+        # never let the compiler write through a hardlink into the cache
+        if os.path.exists(item.output):
+            os.remove(item.output)
+        return False, (cache_key, manifest_key)
+
+    def _cache_store(self, item, pending):
+        cache_key, manifest_key = pending
+        deps = ()
+        if self.depfile_options:
+            deps = depfile.read(item.depfile, exclude=[dep.output for dep in item], remove=False) or ()
+        headers = self._manifest(deps)
+        if cache_key is None and manifest_key is not None:
+            # could not preprocess, the headers it was compiled with identify the object instead
+            cache_key = cache.key(manifest_key, *[part for header in headers for part in header])
+        if cache_key is not None:
+            cache.store(cache_key, item.output, deps)
+        if manifest_key is not None:
+            cache.remember(manifest_key, headers, cache_key)
+
+    def _manifest(self, deps):
+        return [(path, state.database.digest(path) or '') for path in deps]
+
+    def batch_key(self, item):
+        '''Objectives with the same key can be compiled by a single command, if `batch_size` is more than 1'''
+        if self.batch_size <= 1 or type(item) is not targets.Object:
+            return None
+        pch = item.precompiled_header
+        if len(item) != (1 if pch is None else 2):
+            return None
+        return os.path.dirname(item.output), pch.output if pch is not None else None
+
+    def _batch_output(self, item):
+        # where compiling several sources at once puts the object of `item`: the working directory
+        return os.path.splitext(os.path.basename(item[0].output))[0] + self.batch_output_ext
+
+    def _batch_depfile(self, item):
+        # and where `-MMD` in the `batch_options` puts its dependency file
+        return os.path.splitext(self._batch_output(item))[0] + '.d'
+
+    def batch_command(self, items):
+        '''Get the command that compiles several objectives at once'''
+        specific_command = [self.command] + self.options
+        for pp in self.paths:
+            specific_command.append('{}{}'.format(self.path_switch, pp))
+        specific_command.extend(self.batch_options)
+        specific_command.extend(item[0].output for item in items)
+        specific_command.extend(self.post_options)
+        if items[0].precompiled_header is not None:
+            specific_command.extend([self.pch_switch, items[0].precompiled_header.stub])
+        return specific_command
+
+    def execute_batch(self, items, commands):
+        '''Compile several objectives with a single command, returns whether each of them was built. This is called
+        from a worker thread.
+
+        Each object is moved from the working directory to its output once the command finished; an objective
+        whose object was not written failed.
+        '''
+        results = [None] * len(items)
+        batched = []
+        with _batch_lock:
+            for index, item in enumerate(items):
+                temp = self._batch_output(item)
+                # two sources with the same name, or a file that is in the way, are compiled on their own
+                if (temp not in _batch_outputs and not os.path.exists(temp)
+                        and not os.path.exists(self._batch_depfile(item))):
+                    _batch_outputs.add(temp)
+                    batched.append(index)
+        try:
+            pending = {}
+            todo = []
+            for index in batched:
+                if self.cache:
+                    restored, pending[index] = self._cache_lookup(items[index], commands[index])
+                    if restored:
+                        results[index] = True
+                        continue
+                todo.append(index)
+            if todo:
+                ok = scheduler.call(self.batch_command([items[index] for index in todo]))
+                for index in todo:
+                    item = items[index]
+                    temp = self._batch_output(item)
+                    temp_depfile = self._batch_depfile(item)
+                    if not os.path.exists(temp):
+                        if os.path.exists(temp_depfile):
+                            os.remove(temp_depfile)
+                        results[index] = False
+                        continue
+                    os.replace(temp, item.output)
+                    if os.path.exists(temp_depfile):
+                        # nothing reads the dependencies without `depfile_options`, but nothing is left behind either
+                        if self.depfile_options:
+                            os.replace(temp_depfile, item.depfile)
+                        else:
+                            os.remove(temp_depfile)
+                    results[index] = True
+                    if self.cache:
+                        self._cache_store(item, pending[index])
+                if not ok and all(results[index] for index in todo):
+                    # every object was written, so which one failed is unknown; compile them one at a time
+                    for index in todo:
+                        results[index] = None
+        finally:
+            with _batch_lock:
+                for index in batched:
+                    _batch_outputs.discard(self._batch_output(items[index]))
+        for index, item in enumerate(items):
+            if results[index] is None:
+                results[index] = self.execute(item, commands[index])
+        return results
+
+    def _direct_cache_key(self, item, generic_command):
+        '''Key of the manifest of an object, see `cache.find`'''
+        parts = ['direct', cache.compiler_identity(self.command)] + generic_command
+        for path in [dep.output for dep in item]:
+            parts.extend([path, state.database.digest(path) or ''])
+        return cache.key(*parts)
+
+    def _preprocess(self, item, extra_options=()):
+        '''Get the preprocessed source of an object, or None if it could not be preprocessed'''
+        if not self.preprocess_options:
+            return None
+        preprocess = [self.command] + self.options
+        preprocess.extend('{}{}'.format(self.path_switch, pp) for pp in self.paths)
+        preprocess.extend(self.preprocess_options)
+        preprocess.extend(extra_options)
+        if item.precompiled_header is not None:
+            preprocess.extend([self.pch_switch, item.precompiled_header.stub])
+        preprocess.extend(dep.output for dep in item if not isinstance(dep, targets.PrecompiledHeader))
+        # if it cannot be preprocessed, the real compile reports the problem
+        return scheduler.capture(preprocess)
+
+    def _preprocessed_cache_key(self, item, generic_command):
+        preprocessed = self._preprocess(item)
+        if preprocessed is None:
+            return None
+        return cache.key('preprocessed', cache.compiler_identity(self.command), *(generic_command + [preprocessed]))
+
+    def _compile(self, item, command):
+        '''Compile an object on a worker if this compiler is distributed and a worker is available, otherwise
+        locally'''
+        if self.distributed and type(item) is targets.Object:
+            # import here, only distributed compilers need it
+            from bs import distributed
+            ext = None
+            if distributed.WORKERS.value:
+                ext = distributed.PREPROCESSED_EXT.get(os.path.splitext(item[0].output)[1])
+            # the depfile is written while preprocessing, since the worker does not have the headers
+            extra_options = self.depfile_options + [item.depfile] if self.depfile_options else []
+            preprocessed = self._preprocess(item, extra_options) if ext is not None else None
+            if preprocessed is not None:
+                remote_command = [self.command] + self.options
+                remote_command.extend(['<input>', '{}<output>'.format(self.output_switch)])
+                remote_command.extend(self.post_options)
+                compiled = distributed.compile(remote_command, ext, preprocessed, item.output)
+                if compiled is not None:
+                    return compiled
+        return CMDThing.execute(self, item, command)
+
+    def finish(self, item):
+        if self.depfile_options and isinstance(item, targets.Object):
+            deps = depfile.read(item.depfile, exclude=[dep.output for dep in item])
+            # cache hits do not write a depfile, their dependencies were restored from the cache
+            if deps is not None:
+                state.database.set_discovered_deps(item.output, deps)
+
 
 class Linker(CMDThing):
 
     instances = linkers
 
-    # def __init__(self, function, command):
-    #     CMDThing.__init__(self, function, thing)
-    #     self.shared_swtich = ''
-    #     self.static_switch = ''
-    #     self.executable_switch = ''
+    def __init__(self, function, command):
+        CMDThing.__init__(self, function, command)
+        self.archiver = None
+        self.thin_archive = False
+
+    def archives(self, item):
+        '''Whether `item` is a static library that is maintained with the `archiver`, rather than linked'''
+        return bool(self.archiver) and isinstance(item, targets.StaticLibrary)
+
+    def command_for(self, item):
+        if not self.archives(item):
+            return CMDThing.command_for(self, item)
+        modifiers = 'qc' + ('T' if self.thin_archive else '') + 's'
+        return [self.archiver, modifiers, item.output] + [dep.output for dep in item]
+
+    def execute(self, item, command):
+        '''Link `item` or, for an archive whose members did not change, replace only the objects that changed and
+        refresh the symbol index once'''
+        if not self.archives(item):
+            return CMDThing.execute(self, item, command)
+        changed = state.database.changed_inputs(item, command)
+        members = [dep.output for dep in item]
+        # members are replaced by name, so objects with the same name have to be archived from scratch
+        if changed is None or len(set(os.path.basename(mm) for mm in members)) != len(members):
+            if os.path.exists(item.output):
+                os.remove(item.output)
+            return scheduler.call(command)
+        modifiers = 'r' + ('T' if self.thin_archive else '') + 'S'
+        if changed and not scheduler.call([self.archiver, modifiers, item.output] + changed):
+            return False
+        return scheduler.call([self.archiver, 's', item.output])
+
+
+class Swig(object):
+    '''Runs SWIG for `SwigSource` objectives, so that they are generated in parallel with everything else.
+
+    SWIG writes a depfile of the interface files it included, so that changing any of them generates the source
+    again. With `--swig-cache on`, the source and header are looked up in the compilation cache by the SWIG version,
+    the command and the contents of the interface files.
+    '''
+
+    def __reduce__(self):
+        return 'swig'
+
+    @property
+    def pool(self):
+        return targets.SwigSource.POOL.value or None
+
+    def batch_key(self, item):
+        return None
+
+    def command_for(self, item):
+        return item.command()
+
+    def execute(self, item, command):
+        previous = state.database.previous(item.header)
+        if targets.SwigSource.CACHE.value != 'on':
+            ok = scheduler.call(command)
+        else:
+            ok = self._cached_call(item, command)
+        if ok:
+            # like the source, an unchanged header keeps its modification time
+            state.database.restore_mtime(item.header, previous)
+        return ok
+
+    def _cached_call(self, item, command):
+        generic_command = [arg.replace(item.output, '<output>').replace(item.header, '<header>') for arg in command]
+        # like for compiled objects, the interface files it includes are checked against a manifest
+        manifest_key = cache.key('swig', cache.compiler_identity(command[0]), *(generic_command
+                + [item.interface_file, state.database.digest(item.interface_file) or '']))
+        entry_key = cache.find(manifest_key, state.database.digest)
+        if entry_key is not None:
+            source_deps = cache.lookup(cache.key(entry_key, 'source'), item.output)
+            if source_deps is not None and cache.lookup(cache.key(entry_key, 'header'), item.header) is not None:
+                state.database.set_discovered_deps(item.output, source_deps)
+                return True
+        for path in [item.output, item.header]:
+            # never let SWIG write through a hardlink into the cache
+            if os.path.exists(path):
+                os.remove(path)
+        if not scheduler.call(command):
+            return False
+        deps = depfile.read(item.depfile, exclude=[item.interface_file], remove=False) or ()
+        headers = [(path, state.database.digest(path) or '') for path in deps]
+        entry_key = cache.key(manifest_key, *[part for header in headers for part in header])
+        cache.store(cache.key(entry_key, 'source'), item.output, deps)
+        cache.store(cache.key(entry_key, 'header'), item.header, deps)
+        cache.remember(manifest_key, headers, entry_key)
+        return True
+
+    def finish(self, item):
+        deps = depfile.read(item.depfile, exclude=[item.interface_file])
+        # cache hits do not write a depfile, their dependencies were restored from the cache
+        if deps is not None:
+            state.database.set_discovered_deps(item.output, deps)
+        state.database.produced(item.output, item.header)
+
+
+swig = Swig()
+'''The runner of every `SwigSource`'''
 
 
 class _CmdAction(actions.Action):
@@ -173,12 +528,57 @@ class Add(_CmdAction):
                     'start with a `-`. place an escaped space before the argument. For example, in *nix '
                     'systems, `\\ -O2`. On windows this would translate to, `^ -O2`.'
                     .format(self.cmd_type_name))
+        parser.add_argument('--pool',
+                type=str,
+                help='pool of the commands of this {}, e.g. `link`; the depth of each pool is set with '
+                    '`bs config --pools`'.format(self.cmd_type_name))
+        self._add_compiler_arguments(parser)
 
     def invoke(self, args):
         cmd = self.create_cmd(args.function, args.command)
         self._apply_options(cmd, args)
         config.save()
 
+    def _add_compiler_arguments(self, parser):
+        if self.cmd_type is Linker:
+            parser.add_argument('--archiver',
+                    type=str,
+                    help='command that maintains static libraries, e.g. `ar`; only the objects that changed are '
+                        'replaced when a static library is built again')
+            parser.add_argument('--thin-archive',
+                    choices=['on', 'off'],
+                    help='make thin static libraries, which refer to their objects rather than copying them')
+        if self.cmd_type is Compiler:
+            parser.add_argument('--depfile-options',
+                    default=[],
+                    nargs='*',
+                    help='options that make the compiler write a depfile of the headers that were included, the '
+                        'depfile path is appended to them, e.g. `\\ -MMD \\ -MF` for gcc. Escape them in the same way '
+                        'as --options.')
+            parser.add_argument('--cache',
+                    choices=['on', 'off'],
+                    help='look up and store compiled objects in the compilation cache (see `bs cache`)')
+            parser.add_argument('--distributed',
+                    choices=['on', 'off'],
+                    help='send preprocessed sources to the `--workers` to compile (see `bs worker`)')
+            parser.add_argument('--batch-size',
+                    type=int,
+                    help='compile up to this many sources of the same directory with a single command, e.g. '
+                        '`gcc -c a.c b.c`; 0 or 1 compiles one source at a time')
+            parser.add_argument('--batch-options',
+                    default=[],
+                    nargs='*',
+                    help='options added when compiling several sources at once, e.g. `\\ -MMD` for gcc (which then '
+                        'writes a depfile per source) or `/MP` for cl. Escape them in the same way as --options.')
+            parser.add_argument('--pch-switch',
+                    type=str,
+                    help='switch that includes a precompiled header (see `PrecompiledHeader`), e.g. `\\ -include`. '
+                        'Escape it in the same way as --options.')
+            parser.add_argument('--batch-output-ext',
+                    type=str,
+                    help='extension of the objects written to the working directory when compiling several sources '
+                        'at once, e.g. `.o` for gcc or `.obj` for cl')
+
     def _apply_options(self, cmd, args):
         if args.output_switch:
             cmd.output_switch = args.output_switch.strip()
@@ -188,6 +588,26 @@ class Add(_CmdAction):
             cmd.paths = args.paths
         if args.options:
             cmd.options = [co.strip() for co in args.options]
+        if args.pool:
+            cmd.pool = args.pool.strip()
+        if getattr(args, 'depfile_options', None):
+            cmd.depfile_options = [do.strip() for do in args.depfile_options]
+        if getattr(args, 'cache', None):
+            cmd.cache = args.cache == 'on'
+        if getattr(args, 'distributed', None):
+            cmd.distributed = args.distributed == 'on'
+        if getattr(args, 'batch_size', None) is not None:
+            cmd.batch_size = args.batch_size
+        if getattr(args, 'batch_options', None):
+            cmd.batch_options = [bo.strip() for bo in args.batch_options]
+        if getattr(args, 'pch_switch', None):
+            cmd.pch_switch = args.pch_switch.strip()
+        if getattr(args, 'batch_output_ext', None):
+            cmd.batch_output_ext = args.batch_output_ext.strip()
+        if getattr(args, 'archiver', None):
+            cmd.archiver = args.archiver.strip()
+        if getattr(args, 'thin_archive', None):
+            cmd.thin_archive = args.thin_archive == 'on'
 
 
 class Modify(Add):
@@ -235,6 +655,8 @@ def get_actions():
 
 def save(stream):
     '''Save the compilers info into a YAML stream'''
+    # import here, yaml is slow to import and only needed to save the configuration
+    import yaml
     global compilers, linkers
     # Convert everything into a dictionay so that it is not saved as weird YAML/python objects
     for cmd_type_name, cmds in [('compilers', compilers.values()), ('linkers', linkers.values())]:
@@ -263,3 +685,6 @@ def load(config_dict):
             linker = Linker(comp_params['function'], comp_params['command'])
             linker.__dict__.update(comp_params)
 
+
+if config.loaded is not None:
+    load(config.loaded)
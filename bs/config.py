@@ -1,20 +1,41 @@
 from __future__ import absolute_import
 
 import argparse
+import importlib
 import os
+import pickle
 import platform
-
-import yaml
+import sys
 
 items = []
 _by_name = {}
+_values = {}
+'''Loaded values of configuration items that have not been created yet, because their module is not imported'''
 
 CONFIG_NAME = '.bs.{}.yaml'.format(platform.system().lower())
 
+CACHE_FILE = os.path.join('.bs', 'config.cache')
+'''The parsed configuration file, so that it does not need to be parsed again until it changes'''
+
+_CACHE_VERSION = 1
+
+loaded = None
+'''The configuration file as it was loaded, the compilers and linkers and builders modules read their part of it when
+they are imported'''
+
+MODULES = ['bs.targets', 'bs.cache', 'bs.distributed']
+'''Modules that define configuration items, all of them are imported to list or save the configuration'''
+
+def _import_all():
+    for module in MODULES:
+        importlib.import_module(module)
+
 def save():
     # import here to prevent recursive import
     from bs import compilers_and_linkers
     from bs import builders
+    import yaml
+    _import_all()
     config_as_dict = { item.name : item.value for item in items if item.non_default }
     with open(CONFIG_NAME, 'w') as config_file:
         config_file.write('# build-system generated configuration file\n')
@@ -25,23 +46,50 @@ def save():
         compilers_and_linkers.save(config_file)
         builders.save(config_file)
 
+def _read():
+    '''Parse the configuration file, or get it from the cache if the file did not change since it was cached'''
+    st = os.stat(CONFIG_NAME)
+    stamp = (_CACHE_VERSION, os.path.abspath(CONFIG_NAME), st.st_size, st.st_mtime_ns)
+    try:
+        with open(CACHE_FILE, 'rb') as stream:
+            if pickle.load(stream) == stamp:
+                return pickle.load(stream)
+    except Exception:
+        # missing or unreadable, parse the configuration file instead
+        pass
+    # import here, parsing YAML is the slow part of loading the configuration
+    import yaml
+    with open(CONFIG_NAME, 'r') as config_file:
+        conf = yaml.safe_load(config_file)
+    try:
+        if not os.path.exists(os.path.dirname(CACHE_FILE)):
+            os.makedirs(os.path.dirname(CACHE_FILE))
+        temp_path = CACHE_FILE + '.tmp'
+        with open(temp_path, 'wb') as stream:
+            pickle.dump(stamp, stream, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(conf, stream, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, CACHE_FILE)
+    except (IOError, OSError):
+        pass
+    return conf
+
 def load():
+    global loaded
     if os.path.exists(CONFIG_NAME):
-        # import here to prevent recursive import
-        from bs import compilers_and_linkers
-        from bs import builders
-        conf = {}
-        with open(CONFIG_NAME, 'r') as config_file:
-            conf = yaml.load(config_file)
+        conf = _read()
         if not conf:
             return
         for kk, vv in conf.items():
             try:
                 _by_name[kk].value = vv
-            except KeyError: # ignore, not everything is a configuration item
-                pass
-        compilers_and_linkers.load(conf)
-        builders.load(conf)
+            except KeyError: # not everything is a configuration item, or its module is not imported yet
+                _values[kk] = vv
+        loaded = conf
+        # the compilers, linkers and builders are created when their modules are first imported, so that actions
+        # (and builds replayed from a snapshot) that do not use them do not import them either
+        for module in ['bs.compilers_and_linkers', 'bs.builders']:
+            if module in sys.modules:
+                sys.modules[module].load(conf)
 
 
 class ConfigItemAction(argparse.Action):
@@ -56,6 +104,7 @@ class ConfigItemAction(argparse.Action):
 
 def add_command_line_args(parser):
     global items
+    _import_all()
     for item in items:
         parser.add_argument(item.name,
                 action=ConfigItemAction,
@@ -67,6 +116,7 @@ def add_command_line_args(parser):
 
 def print_config():
     global items
+    _import_all()
     item_width = max(len(item.name) for item in items)
     fmt = '{{:<{}}}  {{}}'.format(item_width)
     for item in items:
@@ -79,7 +129,7 @@ class ConfigItem(object):
         self.name = name
         self.default_value = default_value
         self.description = description
-        self._value = None
+        self._value = _values.pop(name, None)
         global items, _by_name
         items.append(self)
         _by_name[self.name] = self
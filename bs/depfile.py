@@ -0,0 +1,71 @@
+'''Reading the Makefile-style dependency files written by compilers (`gcc -MMD -MF <file>`)'''
+from __future__ import absolute_import
+
+import os
+import sys
+
+
+def parse(text):
+    '''Get the prerequisites of the first rule in a depfile.
+
+    Handles line continuations, escaped spaces (`\\ `) and escaped dollar signs (`$$`). Later rules, such as the
+    phony targets written by `-MP`, are ignored.
+    '''
+    text = text.replace('\\\r\n', ' ').replace('\\\n', ' ')
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    words = _split(lines[0])
+    for index, word in enumerate(words):
+        if word.endswith(':'):
+            return words[index + 1:]
+        # the target and its first prerequisite may not be separated by a space; skip a drive letter
+        colon = word.find(':', 2)
+        if colon >= 0:
+            return [word[colon + 1:]] + words[index + 1:]
+    return []
+
+
+def _split(line):
+    words = []
+    word = []
+    ii = 0
+    while ii < len(line):
+        char = line[ii]
+        if char == '\\' and line[ii + 1:ii + 2] in (' ', '#'):
+            ii += 1
+            word.append(line[ii])
+        elif char == '$' and line[ii + 1:ii + 2] == '$':
+            ii += 1
+            word.append('$')
+        elif char in ' \t':
+            if word:
+                words.append(''.join(word))
+                word = []
+        else:
+            word.append(char)
+        ii += 1
+    if word:
+        words.append(''.join(word))
+    return words
+
+
+def read(path, exclude=(), remove=True):
+    '''Read (and remove) a depfile, returning its prerequisites as interned, normalized paths.
+
+    Returns None if the depfile does not exist.
+    '''
+    try:
+        with open(path, 'r') as stream:
+            text = stream.read()
+    except (IOError, OSError):
+        return None
+    if remove:
+        os.remove(path)
+    exclude = set(os.path.normpath(ee) for ee in exclude)
+    deps = []
+    for dep in parse(text):
+        dep = os.path.normpath(dep)
+        if dep not in exclude and dep not in deps:
+            deps.append(sys.intern(dep))
+    return deps
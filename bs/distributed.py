@@ -0,0 +1,306 @@
+'''Distributed compilation: sending preprocessed sources to `bs worker` processes on other machines.
+
+A compiler with `distributed` enabled preprocesses each source locally, and sends it to a worker from `--workers`
+that has a free slot and the same compiler (by the output of `<compiler> --version`). When every worker is busy or
+unreachable the source is compiled locally. Linking always happens locally.
+
+Workers only run one of their allowed compilers, and refuse the options that would run another program, load code or
+write outside of the temporary directory of the compilation (see `_UNSAFE_OPTIONS`). Like distcc they do not
+authenticate clients, so they should only be reachable from trusted machines.
+'''
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+from bs import actions
+from bs import config
+from bs import logger
+from bs import scheduler
+from bs import trace
+
+WORKERS = config.ConfigItem('--workers', [], 'addresses (host:port) of `bs worker` processes to compile on')
+
+PORT = 3633
+
+PREPROCESSED_EXT = {'.c': '.i', '.cc': '.ii', '.cpp': '.ii', '.cxx': '.ii', '.c++': '.ii', '.C': '.ii'}
+'''Sources that can be compiled remotely, and the extension the compiler expects once they are preprocessed'''
+
+_TIMEOUT = 2.0
+'''Seconds to wait for a worker to answer when connecting to it or asking for its capacity'''
+
+_HEADER = struct.Struct('!I')
+
+_UNSAFE_OPTIONS = ('@', '-B', '-wrapper', '-fplugin', '-specs', '--specs', '-fuse-ld', '--ld-path', '-Wl,', '-Wa,',
+        '-Wp,', '-Xlinker', '-Xassembler', '-Xpreprocessor', '-Xclang', '-Xarch', '-mllvm', '-cc1', '-load', '-plugin',
+        '-o', '--output', '-MF', '-dumpdir', '-dumpbase', '-aux-info', '-fdump-', '-fopt-info',
+        '-foptimization-record-file', '--serialize-diagnostics', '-ftime-trace', '-fcrash-diagnostics-dir',
+        '-fmodules-cache-path')
+'''Prefixes of the compiler arguments a worker refuses, other than the output `-o<output>`'''
+
+_lock = threading.Lock()
+_workers = None
+_identities = {}
+
+
+def _read(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send(sock, header, payload=b''):
+    '''Send a message: a JSON header followed by `payload` bytes'''
+    data = json.dumps(dict(header, size=len(payload))).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data + payload)
+
+
+def receive(sock):
+    '''Receive a message sent with `send`, returns its header and payload'''
+    length, = _HEADER.unpack(_read(sock, _HEADER.size))
+    header = json.loads(_read(sock, length).decode('utf-8'))
+    return header, _read(sock, header.get('size', 0))
+
+
+def compiler_identity(command):
+    '''Identify a compiler by its version output, which is the same on every machine with the same compiler'''
+    try:
+        return _identities[command]
+    except KeyError:
+        pass
+    try:
+        result = subprocess.run([command, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        identity = hashlib.md5(result.stdout).hexdigest() if result.returncode == 0 else None
+    except OSError:
+        identity = None
+    _identities[command] = identity
+    return identity
+
+
+def _unsafe_argument(args):
+    '''Get the first argument of a compiler command that a worker refuses to run, or None'''
+    for arg in args[1:]:
+        if arg != '-o<output>' and arg.startswith(_UNSAFE_OPTIONS):
+            return arg
+    return None
+
+
+def _address(text):
+    host, _sep, port = text.rpartition(':')
+    return (host, int(port)) if host else (text, PORT)
+
+
+class _Worker(object):
+
+    def __init__(self, address):
+        self.address = address
+        self.capacity = 0
+        self.running = 0
+        self.identities = {}
+        self.reachable = True
+
+    def __repr__(self):
+        return '{}:{}'.format(*self.address)
+
+    def hello(self, command):
+        '''Ask the worker for its capacity and its identity of a compiler'''
+        try:
+            sock = socket.create_connection(self.address, _TIMEOUT)
+            with sock:
+                send(sock, {'request': 'hello', 'commands': [command]})
+                header, _payload = receive(sock)
+        except (OSError, EOFError, ValueError) as ee:
+            self.fail('is not reachable', ee)
+            return
+        self.capacity = header.get('capacity', 0)
+        self.identities[command] = header.get('identities', {}).get(command)
+
+    def fail(self, problem, error):
+        '''Stop sending sources to the worker, warning about it only once, however many jobs notice'''
+        with _lock:
+            if not self.reachable:
+                return
+            self.reachable = False
+        logger.warning('worker {} {}, compiling locally instead: {}', self, problem, error)
+
+
+def _acquire(command):
+    '''Get a worker with a free slot and the same compiler, or None'''
+    global _workers
+    with _lock:
+        if _workers is None:
+            _workers = [_Worker(_address(address)) for address in WORKERS.value]
+        unknown = [worker for worker in _workers if worker.reachable and command not in worker.identities]
+    for worker in unknown:
+        worker.hello(command)
+    identity = compiler_identity(command)
+    with _lock:
+        candidates = [worker for worker in _workers if worker.reachable and worker.running < worker.capacity
+                and identity is not None and worker.identities.get(command) == identity]
+        if not candidates:
+            return None
+        worker = min(candidates, key=lambda ww: float(ww.running) / ww.capacity)
+        worker.running += 1
+        return worker
+
+
+def _release(worker):
+    with _lock:
+        worker.running -= 1
+
+
+def compile(command, ext, preprocessed, output):
+    '''Compile a preprocessed source on a worker.
+
+    `command` is the compiler command line, with `<input>` and `<output>` in place of the paths. Returns whether the
+    compilation succeeded, or None if no worker could compile it so that it should be compiled locally.
+    '''
+    if _unsafe_argument(command) is not None:
+        # the workers would refuse it
+        return None
+    worker = _acquire(command[0])
+    if worker is None:
+        return None
+    start = trace.now()
+    try:
+        sock = socket.create_connection(worker.address, _TIMEOUT)
+        with sock:
+            # compiling may take a lot longer than connecting
+            sock.settimeout(None)
+            send(sock, {'request': 'compile', 'args': command, 'ext': ext}, preprocessed)
+            header, payload = receive(sock)
+    except (OSError, EOFError, ValueError) as ee:
+        worker.fail('failed', ee)
+        return None
+    finally:
+        _release(worker)
+    if header.get('busy'):
+        return None
+    if trace.ENABLED:
+        trace.complete(os.path.basename(command[0]), start, trace.now(), 'remote', worker=str(worker))
+    scheduler.report(command + ['# on {}'.format(worker)], header.get('status'), header.get('output', ''))
+    if header.get('status') != 0:
+        return False
+    with open(output, 'wb') as stream:
+        stream.write(payload)
+    return True
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        try:
+            header, payload = receive(self.request)
+        except (OSError, EOFError, ValueError):
+            return
+        if header.get('request') == 'hello':
+            identities = {command: compiler_identity(command) for command in header.get('commands', [])
+                    if command in server.allowed}
+            send(self.request, {'capacity': server.capacity, 'identities': identities})
+        elif header.get('request') == 'compile':
+            args = header.get('args') or ['']
+            refused = args[0] if args[0] not in server.allowed else _unsafe_argument(args)
+            if refused is not None:
+                send(self.request, {'status': 1, 'output': 'bs worker: `{}` is not allowed\n'.format(refused)})
+            elif not server.slots.acquire(False):
+                send(self.request, {'busy': True})
+            else:
+                try:
+                    self._compile(args, header.get('ext', '.i'), payload)
+                finally:
+                    server.slots.release()
+
+    def _compile(self, args, ext, payload):
+        directory = tempfile.mkdtemp(prefix='bs-worker')
+        try:
+            source = os.path.join(directory, 'input' + os.path.basename(ext))
+            output = os.path.join(directory, 'output.o')
+            with open(source, 'wb') as stream:
+                stream.write(payload)
+            args = [arg.replace('<input>', source).replace('<output>', output) for arg in args]
+            try:
+                result = subprocess.run(args, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                status, messages = result.returncode, result.stdout.decode('utf-8', 'replace')
+            except OSError as ee:
+                status, messages = 1, 'bs worker: could not run `{}`: {}\n'.format(args[0], ee)
+            data = b''
+            if status == 0:
+                with open(output, 'rb') as stream:
+                    data = stream.read()
+            send(self.request, {'status': status, 'output': messages}, data)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    '''Compiles the sources that are sent to it, up to `capacity` at a time'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, capacity, allowed):
+        socketserver.ThreadingTCPServer.__init__(self, address, _Handler)
+        self.capacity = capacity
+        self.allowed = set(allowed)
+        self.slots = threading.Semaphore(capacity)
+
+
+class Worker(actions.Action):
+
+    def __init__(self):
+        actions.Action.__init__(self,
+                'worker',
+                'compile the sources that other machines send (see the `--workers` configuration)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host',
+                help='address to listen on; workers do not authenticate clients, only listen on an interface that is '
+                    'reachable from trusted machines alone',
+                default='127.0.0.1')
+        parser.add_argument('--port',
+                help='port to listen on',
+                type=int,
+                default=PORT)
+        parser.add_argument('--jobs', '-j',
+                help='number of sources to compile at the same time',
+                type=int,
+                default=os.cpu_count() or 1)
+        parser.add_argument('--allow',
+                help='compiler commands that may be run, in addition to the commands of the configured compilers',
+                nargs='*',
+                default=[])
+
+    def invoke(self, args):
+        from bs import compilers_and_linkers
+        allowed = set(args.allow) | set(cc.command for cc in compilers_and_linkers.compilers.values())
+        if not allowed:
+            logger.error('no compiler is allowed, add compilers with `add-compiler` or use --allow')
+        server = Server((args.host, args.port), args.jobs, allowed)
+        print('bs worker listening on {}:{} with {} slots for {}'.format(
+                args.host, server.server_address[1], args.jobs, ', '.join(sorted(allowed))))
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def get_actions():
+    return [Worker()]
@@ -0,0 +1,107 @@
+'''Deduplicated view of the objective graph.
+
+Objectives that produce the same output (for instance `Object('a.c')` created for two executables) are the same node
+of the graph. Each node gets a stable id, in the order the objectives were first seen, and traversals visit every node
+once. The edges are kept as node ids in integer arrays, rather than as lists of objectives.
+'''
+from __future__ import absolute_import
+
+import array
+import os
+
+
+class Graph(object):
+
+    def __init__(self):
+        self.nodes = []
+        '''The canonical objective of each node, indexed by node id'''
+        self.runners = {}
+        '''The runner (compiler or linker) of each node that was scheduled, the first one to schedule it'''
+        self.pools = {}
+        '''The pool of each node that was scheduled with one (see `scheduler.POOLS`)'''
+        self.copies = []
+        '''The (source, destination) of each `bs.copy` that was skipped because nothing is built (see
+        `scheduler.DRY_RUN`)'''
+        self._ids = {}
+        self._edges = array.array('l')
+        '''The children of the nodes whose children are known, one node after the other'''
+        self._first = array.array('l')
+        '''Index in `_edges` of the first child of each node, or -1 if its children are not known yet'''
+        self._count = array.array('l')
+        '''Number of children of each node'''
+        self._flattened = {}
+
+    def _key(self, target):
+        if target.output is None:
+            return id(target)
+        return os.path.normpath(target.output)
+
+    def add(self, target):
+        '''Get the node id of an objective, adding it to the graph if needed'''
+        output = target.output
+        node = self._ids.get(id(target) if output is None else output)
+        if node is not None:
+            return node
+        key = self._key(target)
+        node = self._ids.get(key)
+        if node is None:
+            node = self._ids[key] = len(self.nodes)
+            self.nodes.append(target)
+            self._first.append(-1)
+            self._count.append(0)
+        if output is not None:
+            # the output as it is spelled, so that finding it again does not need to normalize it
+            self._ids[output] = node
+        return node
+
+    def canonical(self, target):
+        '''Get the objective that represents all of the objectives with the same output'''
+        return self.nodes[self.add(target)]
+
+    def children(self, node):
+        '''Node ids of all of the dependencies of a node'''
+        first = self._first[node]
+        if first < 0:
+            children = [self.add(dep) for dep in self.nodes[node]]
+            first = self._first[node] = len(self._edges)
+            self._count[node] = len(children)
+            self._edges.extend(children)
+        return self._edges[first:first + self._count[node]]
+
+    def flatten(self, target):
+        '''Get an objective and everything that is built along with it, dependencies first.
+
+        The result is computed once per objective; objectives should not be modified after they have been built.
+        '''
+        root = self.add(target)
+        flat = self._flattened.get(root)
+        if flat is not None:
+            return flat
+        flat = []
+        seen = set([root])
+        stack = [(root, iter(self._flattened_children(root)))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in seen:
+                    seen.add(child)
+                    stack.append((child, iter(self._flattened_children(child))))
+                    break
+            else:
+                stack.pop()
+                flat.append(self.nodes[node])
+        self._flattened[root] = flat
+        return flat
+
+    def _flattened_children(self, node):
+        return [self.add(dep) for dep in self.nodes[node].flattened_children()]
+
+
+current = Graph()
+'''The graph of the objectives of this invocation'''
+
+
+def reset():
+    '''Forget every objective, e.g. before the objectives are evaluated again'''
+    global current
+    current = Graph()
@@ -0,0 +1,204 @@
+'''Generating a `build.ninja` file from the objectives, so that ninja can build them.
+
+The objectives file stays the source of truth: the objectives are evaluated without building anything, and every
+objective that would have been built gets a build statement. The ninja file regenerates itself when the objectives
+file or the configuration change.
+'''
+from __future__ import absolute_import, print_function
+
+import os
+import re
+import shlex
+import sys
+
+from bs import actions
+from bs import config
+from bs import graph
+from bs import logger
+from bs import scheduler
+from bs import targets
+
+NINJA_FILE = 'build.ninja'
+
+
+def _escape_path(path):
+    return re.sub(r'([$ :])', r'$\1', os.path.normpath(path))
+
+
+def _paths(paths):
+    return ' '.join(_escape_path(path) for path in paths)
+
+
+def _shell(args):
+    # ninja runs commands with the shell, and treats `$` as the start of a variable
+    return ' '.join(shlex.quote(arg) for arg in args).replace('$', '$$')
+
+
+def rule_name(runner, item=None):
+    '''Name of the rule of a compiler or linker, or of its archiver if it archives `item`'''
+    from bs import compilers_and_linkers
+    if isinstance(runner, compilers_and_linkers.Compiler):
+        kind = 'compile'
+    else:
+        kind = 'archive' if item is not None and runner.archives(item) else 'link'
+    return _rule_name(kind, runner)
+
+
+def _rule_name(kind, runner):
+    return '{}_{}'.format(kind, re.sub(r'[^A-Za-z0-9_]', '_', runner.function))
+
+
+def _rule(stream, runner):
+    '''Write the rule of a compiler or linker, which runs the same command as `runner.command_for`'''
+    from bs import compilers_and_linkers
+    prefix = [runner.command] + runner.options + ['{}{}'.format(runner.path_switch, pp) for pp in runner.paths]
+    command = [_shell(prefix), '$in', _shell([runner.output_switch]) + '$out' if runner.output_switch else '$out']
+    command.append(_shell(runner.post_options))
+    depfile = isinstance(runner, compilers_and_linkers.Compiler) and runner.depfile_options
+    if depfile:
+        command.extend([_shell(runner.depfile_options), '$out.d'])
+    if isinstance(runner, compilers_and_linkers.Compiler):
+        command.append('$pch')
+    stream.write('rule {}\n'.format(rule_name(runner)))
+    stream.write('  command = {}\n'.format(' '.join(part for part in command if part)))
+    stream.write('  description = {} $out\n'.format(runner.function))
+    if depfile:
+        stream.write('  depfile = $out.d\n')
+        stream.write('  deps = gcc\n')
+    if runner.pool:
+        stream.write('  pool = {}\n'.format(runner.pool))
+    stream.write('  restat = 1\n\n')
+    if isinstance(runner, compilers_and_linkers.Linker) and runner.archiver:
+        # ninja cannot replace only the members that changed, so archives are made from scratch
+        modifiers = 'qc' + ('T' if runner.thin_archive else '') + 's'
+        stream.write('rule {}\n'.format(_rule_name('archive', runner)))
+        stream.write('  command = rm -f $out && {} {} $out $in\n'.format(_shell([runner.archiver]), modifiers))
+        stream.write('  description = {} $out\n'.format(runner.archiver))
+        if runner.pool:
+            stream.write('  pool = {}\n'.format(runner.pool))
+        stream.write('\n')
+
+
+def write(stream, path=NINJA_FILE, dag=None):
+    '''Write the ninja file at `path` of the objectives in a graph, by default the current one'''
+    from bs import compilers_and_linkers
+    dag = dag or graph.current
+    stream.write('# generated by `bs generate-ninja`, changes will be lost\n')
+    stream.write('ninja_required_version = 1.7\n\n')
+    for pool, depth in sorted(scheduler.pool_depths().items()):
+        stream.write('pool {}\n  depth = {}\n\n'.format(pool, depth))
+    for runner in list(compilers_and_linkers.compilers.values()) + list(compilers_and_linkers.linkers.values()):
+        _rule(stream, runner)
+    stream.write('rule swig\n')
+    stream.write('  command = swig $flags -o $out -oh $header -MMD -MF $out.d $args $in\n')
+    stream.write('  description = swig $in\n')
+    stream.write('  depfile = $out.d\n')
+    stream.write('  deps = gcc\n')
+    pool = targets.SwigSource.POOL.value
+    if pool:
+        stream.write('  pool = {}\n'.format(pool))
+    stream.write('  restat = 1\n\n')
+    stream.write('rule regenerate\n')
+    stream.write('  command = {} -m bs generate-ninja --output $out\n'.format(_shell([sys.executable])))
+    stream.write('  description = regenerating $out\n')
+    stream.write('  generator = 1\n\n')
+
+    used = set()
+    outputs = []
+    generated = []
+    for node, item in enumerate(dag.nodes):
+        if isinstance(item, targets.UnitySource):
+            # walking the objectives did not write the unity sources, nor the stubs of the precompiled headers
+            item.write()
+            generated.append(item.output)
+            continue
+        if isinstance(item, targets.SwigSource):
+            _swig(stream, item)
+            used.update(os.path.normpath(path) for path in item.inputs())
+            continue
+        runner = dag.runners.get(node)
+        if runner is None:
+            continue
+        explicit = [dep.output for dep in item if not isinstance(dep, targets.PrecompiledHeader)]
+        implicit = []
+        pch = None
+        if isinstance(item, targets.Object):
+            for dep in item:
+                if isinstance(dep, targets.UnitySource):
+                    implicit.extend(dep.sources)
+            pch = item.precompiled_header
+            if pch is not None:
+                implicit.append(pch.output)
+        stream.write('build {}: {} {}'.format(_escape_path(item.output), rule_name(runner, item), _paths(explicit)))
+        if implicit:
+            stream.write(' | {}'.format(_paths(implicit)))
+        stream.write('\n')
+        if pch is not None:
+            stream.write('  pch = {}\n'.format(_shell([runner.pch_switch, pch.stub])))
+        pool = dag.pools.get(node)
+        if pool and pool != runner.pool:
+            stream.write('  pool = {}\n'.format(pool))
+        used.update(os.path.normpath(path) for path in explicit + implicit)
+        outputs.append(os.path.normpath(item.output))
+    if dag.copies:
+        stream.write('\nrule copy\n')
+        stream.write('  command = {} $in $out\n'.format(_shell([sys.executable, '-c',
+                'import shutil, sys; shutil.copy(sys.argv[1], sys.argv[2])'])))
+        stream.write('  description = copying $in -> $out\n')
+        for source, destination in dag.copies:
+            stream.write('build {}: copy {}\n'.format(_escape_path(destination), _escape_path(source)))
+            used.add(os.path.normpath(source))
+            outputs.append(os.path.normpath(destination))
+    # generating the ninja file also writes the unity sources and the stubs of precompiled headers
+    stream.write('\nbuild {}{}: regenerate {}\n'.format(_escape_path(path),
+            ' | ' + _paths(generated) if generated else '',
+            _paths([targets.OBJECTIVES_FILE] + ([config.CONFIG_NAME] if os.path.exists(config.CONFIG_NAME) else []))))
+    defaults = [output for output in outputs if output not in used]
+    if defaults:
+        stream.write('\ndefault {}\n'.format(_paths(defaults)))
+
+
+def _swig(stream, item):
+    if item.target_language is None:
+        logger.error('You must specify a target language for a SwigSource\n'
+                'This can be done in the `{}` file by setting the SwigSource.target_language attribute',
+                targets.OBJECTIVES_FILE)
+    flags = ['-{}'.format(item.target_language)] + (['-c++'] if item.cpp else [])
+    stream.write('build {} | {}: swig {}'.format(_escape_path(item.output), _escape_path(item.header),
+            _escape_path(item.interface_file)))
+    sources = item.inputs()[1:]
+    if sources:
+        stream.write(' | {}'.format(_paths(sources)))
+    stream.write('\n  flags = {}\n  header = {}\n'.format(_shell(flags), _shell([item.header])))
+    if item.args:
+        stream.write('  args = {}\n'.format(_shell(item.args)))
+
+
+def generate(path=NINJA_FILE):
+    '''Evaluate the objectives without building them, and write a ninja file that builds them'''
+    actions.walk_objectives()
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as stream:
+        write(stream, path)
+    os.replace(temp_path, path)
+
+
+class GenerateNinja(actions.Action):
+
+    def __init__(self):
+        actions.Action.__init__(self,
+                'generate-ninja',
+                'write a ninja file that builds the objectives, and regenerates itself when they change')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o',
+                help='path of the ninja file',
+                default=NINJA_FILE)
+
+    def invoke(self, args):
+        generate(args.output)
+        print('wrote {}, build with `ninja -f {}`'.format(args.output, args.output))
+
+
+def get_actions():
+    return [GenerateNinja()]
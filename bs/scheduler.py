@@ -0,0 +1,522 @@
+from __future__ import absolute_import, print_function
+
+import collections
+import contextlib
+import heapq
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent import futures
+
+import bs
+from bs import config
+from bs import graph
+from bs import logger
+from bs import snapshot
+from bs import state
+from bs import timings
+from bs import trace
+
+JOBS = 1
+'''Maximum number of commands that are run at the same time'''
+
+KEEP_GOING = False
+'''Keep building whatever does not depend on a failed objective'''
+
+MAX_LOAD = None
+'''Do not start another command while the load average is at least this high, None to ignore the load'''
+
+MIN_FREE_MEMORY = None
+'''Do not start another command while less than this many bytes of memory are available, None to ignore memory'''
+
+VERBOSE = False
+'''Print the command line of every command that is run, rather than the outputs that are built and the commands that
+failed'''
+
+LOG_FILE = os.path.join(state.STATE_DIR, 'output.log.gz')
+'''Log of the command line, output and status of every command of the last build (see `open_log`)'''
+
+DRY_RUN = False
+'''Only record what would be built in `graph.current` rather than building it, e.g. to generate a ninja file'''
+
+POOLS = config.ConfigItem('--pools', [], 'named pools that limit how many of their commands run at the same time, '
+        'e.g. `link=2 swig=1`; compilers, linkers and builders are assigned a pool with --pool')
+
+failed = []
+'''Objectives that could not be built during this invocation (failed or skipped)'''
+
+_THROTTLE_INTERVAL = 0.5
+'''Seconds between checks of the load and memory while commands are held back by them'''
+
+_pending = collections.OrderedDict()
+_pools = {}
+_batch_depth = 0
+
+_loop = None
+_loop_lock = threading.Lock()
+_console_lock = threading.Lock()
+_log = None
+_log_path = None
+
+
+def schedule(item, runner, pool=None):
+    '''Schedule an objective to be built by a runner (a compiler or linker) on the next `flush`.
+
+    The first runner to schedule an objective (or another objective with the same output) is the one that builds it.
+    The command that builds it counts towards `pool`, or the pool of the runner, if any.
+    '''
+    snapshot.record(schedule, item, runner, pool)
+    node = graph.current.add(item)
+    pool = pool or getattr(runner, 'pool', None)
+    if node not in _pending:
+        _pending[node] = runner
+        if pool:
+            _pools[node] = pool
+    if node not in graph.current.runners:
+        graph.current.runners[node] = runner
+        if pool:
+            graph.current.pools[node] = pool
+
+
+def forget():
+    '''Forget everything that was scheduled but not built yet, and the graph'''
+    _pending.clear()
+    _pools.clear()
+    graph.reset()
+
+
+def add_arguments(parser):
+    '''Add the arguments that control how many commands are run at the same time to the parser of an action (see
+    `configure`)'''
+    parser.add_argument('--jobs', '-j',
+            help='number of commands to run at the same time; without a value, the number of CPUs',
+            type=int,
+            nargs='?',
+            const=os.cpu_count() or 1,
+            default=1)
+    parser.add_argument('--max-load',
+            help='do not start another command while the load average is this high, unless nothing is running',
+            type=float)
+    parser.add_argument('--min-free-memory',
+            help='do not start another command while less memory is available (e.g. 2G), unless nothing is '
+                'running')
+    parser.add_argument('--verbose', '-v',
+            help='print the command line of every command, rather than only of the commands that failed',
+            action='store_true')
+
+
+def configure(args):
+    '''Run commands as requested by the arguments added with `add_arguments`'''
+    global JOBS, MAX_LOAD, MIN_FREE_MEMORY, VERBOSE
+    # import here, the cache imports the actions
+    from bs import cache
+    JOBS = args.jobs
+    VERBOSE = args.verbose
+    MAX_LOAD = args.max_load
+    MIN_FREE_MEMORY = cache.parse_size(args.min_free_memory) if args.min_free_memory else None
+
+
+def pool_depths():
+    '''The configured `--pools`, as a dictionary of name to depth'''
+    depths = {}
+    for entry in POOLS.value:
+        name, _sep, depth = entry.partition('=')
+        try:
+            depths[name.strip()] = int(depth)
+        except ValueError:
+            depths[name.strip()] = 0
+        if depths[name.strip()] < 1:
+            logger.error('could not understand the pool `{}`, expected a name and a depth such as `link=2`', entry)
+    return depths
+
+
+def available_memory():
+    '''Bytes of memory available for new processes (`MemAvailable` in /proc/meminfo), or None if unknown'''
+    try:
+        with open('/proc/meminfo', 'rb') as stream:
+            for line in stream:
+                if line.startswith(b'MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def overloaded():
+    '''Whether the load average or the available memory are past `MAX_LOAD` or `MIN_FREE_MEMORY`'''
+    if MAX_LOAD is not None and hasattr(os, 'getloadavg') and os.getloadavg()[0] >= MAX_LOAD:
+        return True
+    if MIN_FREE_MEMORY is not None:
+        memory = available_memory()
+        if memory is not None and memory < MIN_FREE_MEMORY:
+            return True
+    return False
+
+
+@contextlib.contextmanager
+def batch():
+    '''Defer `flush` until the outermost `batch` exits, so that everything scheduled inside of it
+    is built as a single graph.'''
+    global _batch_depth
+    _batch_depth += 1
+    try:
+        yield
+    finally:
+        _batch_depth -= 1
+    flush()
+
+
+def flush():
+    '''Build everything that has been scheduled, running up to `JOBS` commands at the same time.
+
+    An objective is started as soon as all of the scheduled objectives it depends on have finished; of the ready
+    objectives, those with the longest path to the end of the build (by how long their objectives took last time, see
+    `timings`) are started first. Ready objectives with the same `runner.batch_key` are built together, by up to
+    `runner.batch_size` at a time, with `runner.execute_batch`.
+
+    No more than the depth of a pool of commands of that pool run at the same time; other commands may start while
+    they wait for it. Nor is another command started while the machine is `overloaded`, unless nothing is running.
+
+    An output that is built again with the same contents keeps its previous modification time (see
+    `state.Database.restore_mtime`).
+    '''
+    if _batch_depth > 0 or not _pending:
+        return
+    snapshot.record(flush)
+    if DRY_RUN:
+        _pending.clear()
+        _pools.clear()
+        return
+    dag = graph.current
+    runners = dict(_pending)
+    nodes = list(_pending)
+    _pending.clear()
+    pools = dict(_pools)
+    _pools.clear()
+    depths = pool_depths()
+    for pool in set(pools.values()):
+        if pool not in depths:
+            logger.error('unknown pool `{}`, add it to the configuration with `bs config --pools {}=<depth>`',
+                    pool, pool)
+
+    directories = set()
+    for node in nodes:
+        item = dag.nodes[node]
+        directories.add(os.path.dirname(item.output))
+        directories.update(os.path.dirname(path) for path in item.inputs())
+    bs.scan(*sorted(directories))
+
+    failed_nodes = set(dag.add(item) for item in failed)
+    waiting = {}
+    dependents = collections.defaultdict(list)
+    for node in nodes:
+        deps = [dep for dep in dag.children(node) if dep in runners]
+        waiting[node] = len(deps)
+        for dep in deps:
+            dependents[dep].append(node)
+
+    # the estimated time from starting each objective to the end of the build
+    remaining = {}
+    order = [node for node in nodes if waiting[node] == 0]
+    unmet = dict(waiting)
+    for node in order:
+        for dependent in dependents[node]:
+            unmet[dependent] -= 1
+            if unmet[dependent] == 0:
+                order.append(dependent)
+    # the command of each objective, a different command may take a different time
+    node_commands = {}
+    for node in reversed(order):
+        node_commands[node] = runners[node].command_for(dag.nodes[node])
+        remaining[node] = timings.log.estimate(dag.nodes[node].output, node_commands[node]) + max(
+                [remaining[dependent] for dependent in dependents[node]] or [0.0])
+
+    # the modification time and digest of each output before it is built again, to restore an unchanged output's
+    previous = {}
+
+    ready = []
+    sequence = itertools.count()
+    for node in nodes:
+        if waiting[node] == 0:
+            heapq.heappush(ready, (-remaining[node], next(sequence), node))
+    running = {}
+    stopped = False
+
+    def finish(node, ok, command=None, built=False):
+        item = dag.nodes[node]
+        if ok:
+            if built:
+                bs.invalidate(item.output)
+                runners[node].finish(item)
+            state.database.record(item, command)
+        else:
+            failed.append(item)
+            failed_nodes.add(node)
+        for dependent in dependents[node]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                heapq.heappush(ready, (-remaining[dependent], next(sequence), dependent))
+
+    # commands that are waiting for their pool, or for the machine to be less busy: (runner, chunk, pool)
+    parked = collections.deque()
+    in_pool = collections.Counter()
+
+    def pool_full(pool):
+        return pool is not None and in_pool[pool] >= depths[pool]
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, JOBS)) as executor:
+        while running or (not stopped and (ready or parked)):
+            groups = collections.OrderedDict()
+            # commands that wait for their pool do not take up a job, so other objectives may be checked meanwhile
+            startable = len(running) + sum(1 for _runner, _chunk, pool in parked if not pool_full(pool))
+            while ready and not stopped and startable < max(1, JOBS):
+                node = heapq.heappop(ready)[2]
+                item = dag.nodes[node]
+                if any(dep in failed_nodes for dep in dag.children(node)):
+                    finish(node, False)
+                    continue
+                runner = runners[node]
+                command = node_commands[node]
+                if trace.ENABLED:
+                    start = trace.now()
+                    dirty = item.needs_updating or state.database.command_changed(item, command)
+                    trace.complete('check ' + item.output, start, trace.now(), 'check', dirty=dirty)
+                else:
+                    dirty = item.needs_updating or state.database.command_changed(item, command)
+                if not dirty:
+                    finish(node, True, command)
+                    continue
+                previous[node] = state.database.previous(item.output)
+                output_dir = os.path.dirname(item.output)
+                if output_dir and bs.stat(output_dir) is None:
+                    os.makedirs(output_dir)
+                    bs.invalidate(output_dir)
+                batch_key = runner.batch_key(item)
+                if batch_key is not None:
+                    # wait for the rest of the ready objectives, they may be built by the same command
+                    groups.setdefault((id(runner), batch_key, pools.get(node)), []).append((node, command))
+                    continue
+                parked.append((runner, [(node, command)], pools.get(node)))
+                startable += 0 if pool_full(pools.get(node)) else 1
+            free = max(1, max(1, JOBS) - startable)
+            for (_runner_id, _batch_key, pool), members in groups.items():
+                runner = runners[members[0][0]]
+                # spread the objectives over the free jobs, rather than filling up one batch after another
+                size = max(1, min(runner.batch_size, -(-len(members) // free)))
+                for index in range(0, len(members), size):
+                    parked.append((runner, members[index:index + size], pool))
+            # start commands in order, skipping those whose pool is full
+            throttled = False
+            held = collections.deque()
+            while parked and not stopped:
+                runner, chunk, pool = parked.popleft()
+                if pool_full(pool):
+                    held.append((runner, chunk, pool))
+                    continue
+                if running and (len(running) >= max(1, JOBS) or throttled or overloaded()):
+                    throttled = len(running) < max(1, JOBS)
+                    held.append((runner, chunk, pool))
+                    continue
+                items = [dag.nodes[node] for node, _command in chunk]
+                commands = [command for _node, command in chunk]
+                if not VERBOSE:
+                    # verbose builds print the commands that are run instead, see `call`
+                    _print(' '.join(item.output for item in items))
+                if len(chunk) == 1:
+                    future = executor.submit(_execute, runner, items[0], commands[0])
+                else:
+                    future = executor.submit(_execute_batch, runner, items, commands)
+                running[future] = chunk, pool, time.time()
+                if pool is not None:
+                    in_pool[pool] += 1
+            held.extend(parked)
+            parked = held
+            if not running:
+                continue
+            # while throttled, check the load and memory again every so often
+            done, _not_done = futures.wait(running, timeout=_THROTTLE_INTERVAL if throttled else None,
+                    return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                chunk, pool, start = running.pop(future)
+                if pool is not None:
+                    in_pool[pool] -= 1
+                seconds = (time.time() - start) / len(chunk)
+                for (node, command), ok in zip(chunk, future.result()):
+                    if ok:
+                        timings.log.record(dag.nodes[node].output, command, seconds)
+                        state.database.restore_mtime(dag.nodes[node].output, previous.pop(node))
+                    finish(node, ok, command, built=True)
+                    if not ok and not KEEP_GOING:
+                        stopped = True
+
+    if stopped:
+        logger.error('subprocess call failed')
+
+
+def _execute(runner, item, command):
+    if not trace.ENABLED:
+        return [runner.execute(item, command)]
+    with trace.span(item.output, 'job'):
+        return [runner.execute(item, command)]
+
+
+def _execute_batch(runner, items, commands):
+    if not trace.ENABLED:
+        return runner.execute_batch(items, commands)
+    with trace.span('batch of {}'.format(len(items)), 'job', outputs=[item.output for item in items]):
+        return runner.execute_batch(items, commands)
+
+
+def _print(text):
+    with _console_lock:
+        print(text)
+        sys.stdout.flush()
+
+
+def open_log(path=LOG_FILE):
+    '''Write the output of every command to a compressed log, until `close_log`. The log is only replaced once a
+    command is run, so that a build with nothing to do keeps the log of the previous build.'''
+    global _log_path
+    close_log()
+    _log_path = path
+
+
+def close_log():
+    global _log, _log_path
+    with _console_lock:
+        if _log is not None:
+            _log.close()
+        _log = None
+        _log_path = None
+
+
+def _write_log(text):
+    global _log
+    if _log is None:
+        if _log_path is None:
+            return
+        directory = os.path.dirname(_log_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        import gzip
+        _log = gzip.open(_log_path, 'wb', compresslevel=1)
+    _log.write(text.encode('utf-8'))
+
+
+def _event_loop():
+    '''The event loop that runs every command, in a thread of its own'''
+    global _loop
+    # import here, asyncio is slow to import and a build with nothing to do runs no command
+    import asyncio
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='bs commands')
+            thread.daemon = True
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+async def _run(command, capture=False):
+    '''Run a command, returns its status, output, standard error (if it is captured apart) and resource usage'''
+    import asyncio
+    stderr = subprocess.PIPE if capture else subprocess.STDOUT
+    if not hasattr(os, 'wait4'):
+        # Windows, where the resource usage of a command is not known
+        process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=stderr)
+        output, errors = await process.communicate()
+        return process.returncode, output, errors or b'', None
+    loop = asyncio.get_running_loop()
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+    pipes = [process.stdout, process.stderr] if capture else [process.stdout]
+    outputs = await asyncio.gather(*[_read(loop, pipe) for pipe in pipes])
+    _pid, status, rusage = await _wait(process.pid)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    return process.returncode, outputs[0], outputs[1] if capture else b'', rusage
+
+
+async def _read(loop, pipe):
+    import asyncio
+    reader = asyncio.StreamReader()
+    transport, _protocol = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        return await reader.read()
+    finally:
+        transport.close()
+
+
+async def _wait(pid):
+    '''Reap a command with `os.wait4`, so that its own resource usage is known, returns what `os.wait4` returns'''
+    import asyncio
+    loop = asyncio.get_running_loop()
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # before Linux 5.3 or on other systems, a thread waits for the command instead
+        return await loop.run_in_executor(None, os.wait4, pid, 0)
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+    return os.wait4(pid, 0)
+
+
+def call(command):
+    '''Run a command on the event loop of the commands, returns True if it succeeded. This blocks the calling thread
+    (a job) until the command finished.
+
+    The output of the command is printed and logged once it finished, see `report`.
+    '''
+    try:
+        status, output, _errors = _call(command, False)
+    except OSError as ee:
+        logger.warning('could not run `{}`: {}', command[0], ee)
+        return False
+    report(command, status, output.decode('utf-8', 'replace'))
+    return status == 0
+
+
+def capture(command):
+    '''Run a command like `call`, but return its standard output instead of printing it, or None if it failed.
+
+    What the command writes to its standard error is only logged: whatever uses the output reports the problems, e.g.
+    the compiler that is run on a source that could not be preprocessed.
+    '''
+    try:
+        status, output, errors = _call(command, True)
+    except OSError:
+        return None
+    with _console_lock:
+        _write_log('$ {}\n{}[exit status {}]\n'.format(' '.join(command), errors.decode('utf-8', 'replace'), status))
+    return output if status == 0 else None
+
+
+def _call(command, capture):
+    if VERBOSE:
+        _print(' '.join(command))
+    start = trace.now()
+    loop = _event_loop()
+    import asyncio
+    status, output, errors, rusage = asyncio.run_coroutine_threadsafe(_run(command, capture), loop).result()
+    if trace.ENABLED:
+        trace.command(command, start, trace.now(), rusage)
+    return status, output, errors
+
+
+def report(command, status, text):
+    '''Print the output of a finished command as a single block, along with the command line if it failed, and write
+    it to the log of the build (see `open_log`)'''
+    with _console_lock:
+        if status != 0:
+            sys.stdout.write('FAILED: {}\n'.format(' '.join(command)))
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        _write_log('$ {}\n{}[exit status {}]\n'.format(' '.join(command), text, status))
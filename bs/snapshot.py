@@ -0,0 +1,105 @@
+'''Snapshot of an evaluated objectives file, so that a no-op build does not need to evaluate it again.
+
+While the objectives file is evaluated, every call that builds something (scheduling an objective, building a SWIG
+source, copying a file, ...) is recorded along with the objectives and compilers it was called with. The snapshot is
+reused as long as neither the objectives file nor the configuration file changed.
+
+Compilers and linkers are recorded by their function, and replayed with the ones of the current configuration. The
+snapshot is also discarded when the code of bs changes, or when replaying it fails.
+
+An objectives file whose result depends on anything else, for instance a `glob` of the source directory, should be
+built with `bs build --no-snapshot` when that changes.
+'''
+from __future__ import absolute_import
+
+import os
+import pickle
+import sys
+
+SNAPSHOT_FILE = os.path.join('.bs', 'objectives.snapshot')
+
+VERSION = 2
+
+_calls = None
+
+
+def _stamp(paths):
+    import bs
+    stamp = [VERSION, sys.version_info[:2], bs.__version__]
+    # the recorded calls are only valid for the code of bs that recorded them
+    package = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package)):
+        if name.endswith('.py'):
+            st = os.stat(os.path.join(package, name))
+            stamp.append((name, st.st_size, st.st_mtime_ns))
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamp.append((path, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append((path, None, None))
+    return stamp
+
+
+def record(function, *args):
+    '''Record a call to replay when the snapshot is used, if the objectives are being evaluated for a snapshot'''
+    if _calls is not None:
+        _calls.append((function, args))
+
+
+def start():
+    '''Start recording calls'''
+    global _calls
+    _calls = []
+
+
+def save(*paths):
+    '''Stop recording and save the calls, the snapshot stays valid as long as none of `paths` change'''
+    global _calls
+    calls, _calls = _calls, None
+    if calls is None:
+        return
+    directory = os.path.dirname(SNAPSHOT_FILE)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    temp_path = SNAPSHOT_FILE + '.tmp'
+    try:
+        with open(temp_path, 'wb') as stream:
+            pickle.dump(_stamp(paths), stream, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(calls, stream, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        # something in the objectives file cannot be pickled, it will just be evaluated every time
+        os.remove(temp_path)
+        if os.path.exists(SNAPSHOT_FILE):
+            os.remove(SNAPSHOT_FILE)
+        return
+    os.replace(temp_path, SNAPSHOT_FILE)
+
+
+def replay(*paths):
+    '''Replay the recorded calls if the snapshot is still valid for `paths`, returns whether it was replayed'''
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as stream:
+            if pickle.load(stream) != _stamp(paths):
+                return False
+            calls = pickle.load(stream)
+    except Exception:
+        # a missing, truncated or outdated snapshot (e.g. a class was renamed) just means evaluating again
+        return False
+    try:
+        for function, args in calls:
+            function(*args)
+    except Exception as ee:
+        from bs import logger
+        logger.warning('could not replay the snapshot of the objectives, evaluating them instead: {}', ee)
+        discard()
+        return False
+    return True
+
+
+def discard():
+    '''Remove the snapshot, so that the objectives are evaluated next time'''
+    try:
+        os.remove(SNAPSHOT_FILE)
+    except OSError:
+        pass
@@ -0,0 +1,218 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+import pickle
+import time
+
+import bs
+
+STATE_DIR = '.bs'
+
+STATE_FILE = os.path.join(STATE_DIR, 'state.db')
+
+_RACY_SECONDS = 2.0
+'''Files modified this recently may change again without changing size or mtime, so their digests are not saved'''
+
+
+def file_digest(path):
+    '''Hash the contents of a file, returns None if the file does not exist'''
+    hasher = hashlib.md5()
+    try:
+        with open(path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(1 << 16), b''):
+                hasher.update(chunk)
+    except (IOError, OSError):
+        return None
+    return hasher.hexdigest()
+
+
+def command_digest(command):
+    '''Hash a command line (a list of arguments)'''
+    return hashlib.md5('\0'.join(command).encode('utf-8')).hexdigest()
+
+
+class Database(object):
+    '''Content signatures of the inputs and outputs of every objective that has been built.
+
+    An objective is up to date when its output and each of its inputs hash to the same value as when it was last
+    built. Files are only hashed again when their size or mtime changed.
+    '''
+
+    VERSION = 4
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.targets = {}
+        self.deps = {}
+        '''Dependencies discovered while building an objective (e.g. headers from a depfile) by output path'''
+        self.manifest = {}
+        '''Every file that was written by building an objective, and the output of that objective, for `clean`'''
+        self._loaded = False
+        self._modified = False
+
+    def load(self):
+        self._loaded = True
+        try:
+            with open(self.path, 'rb') as stream:
+                data = pickle.load(stream)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return
+        if data.get('version') == self.VERSION:
+            self.files = data['files']
+            self.targets = data['targets']
+            self.deps = data['deps']
+            self.manifest = data['manifest']
+
+    def save(self):
+        if not self._modified:
+            return
+        cutoff = time.time() - _RACY_SECONDS
+        files = {path: sig for path, sig in self.files.items() if sig[1] < cutoff}
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as stream:
+            pickle.dump({'version': self.VERSION, 'files': files, 'targets': self.targets, 'deps': self.deps,
+                    'manifest': self.manifest}, stream, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+        self._modified = False
+
+    def digest(self, path):
+        '''Content digest of a file, only re-hashed if its size or mtime changed'''
+        if not self._loaded:
+            self.load()
+        st = bs.stat(path)
+        if st is None:
+            return None
+        sig = self.files.get(path)
+        if sig is not None and sig[0] == st.st_size and sig[1] == st.st_mtime:
+            return sig[2]
+        digest = file_digest(path)
+        self.files[path] = (st.st_size, st.st_mtime, digest)
+        self._modified = True
+        return digest
+
+    def previous(self, path):
+        '''The modification time and digest of a file that is about to be built again, for `restore_mtime`'''
+        st = bs.stat(path)
+        if st is None:
+            return None
+        return st.st_mtime_ns, self.digest(path)
+
+    def restore_mtime(self, path, previous):
+        '''Give a file that was built again with the same contents its `previous` modification time, so that whatever
+        depends on it is not built again either, even by tools that only compare modification times. Returns whether
+        the file was unchanged.'''
+        bs.invalidate(path)
+        if previous is None:
+            return False
+        if self.digest(path) != previous[1]:
+            return False
+        st = bs.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, previous[0]))
+        bs.invalidate(path)
+        st = bs.stat(path)
+        self.files[path] = (st.st_size, st.st_mtime, previous[1])
+        return True
+
+    def discovered_deps(self, output):
+        '''Get the dependencies that were discovered when building an output, None if they are not known'''
+        if not self._loaded:
+            self.load()
+        return self.deps.get(output)
+
+    def set_discovered_deps(self, output, deps):
+        if not self._loaded:
+            self.load()
+        deps = tuple(deps)
+        if self.deps.get(output) != deps:
+            self.deps[output] = deps
+            self._modified = True
+
+    def signature(self, target, command=None):
+        '''Current signature of an objective: the digests of its output, each of its inputs and the command that
+        built it'''
+        return {
+            'output': self.digest(target.output),
+            'inputs': {path: self.digest(path) for path in target.inputs()},
+            'command': command_digest(command) if command is not None else None,
+        }
+
+    def up_to_date(self, target):
+        '''Whether the objective was built from its current inputs, or None if it has never been recorded'''
+        if not self._loaded:
+            self.load()
+        record = self.targets.get(target.output)
+        if record is None:
+            return None
+        if record['output'] is None or record['output'] != self.digest(target.output):
+            return False
+        # an objective may list the same input twice, it is recorded once
+        inputs = set(target.inputs())
+        if len(inputs) != len(record['inputs']):
+            return False
+        return all(record['inputs'].get(path, False) == self.digest(path) for path in inputs)
+
+    def command_changed(self, target, command):
+        '''Whether the objective was last built with a different command'''
+        if not self._loaded:
+            self.load()
+        record = self.targets.get(target.output)
+        return record is not None and record['command'] != command_digest(command)
+
+    def changed_inputs(self, target, command=None):
+        '''Inputs that changed since the objective was last built, or None if it has to be built from scratch: it was
+        never recorded, it was built with another command or other inputs, or its output changed since'''
+        if not self._loaded:
+            self.load()
+        record = self.targets.get(target.output)
+        if record is None or record['output'] is None or record['output'] != self.digest(target.output):
+            return None
+        if command is not None and record['command'] != command_digest(command):
+            return None
+        inputs = list(dict.fromkeys(target.inputs()))
+        if set(inputs) != set(record['inputs']):
+            return None
+        return [path for path in inputs if record['inputs'][path] != self.digest(path)]
+
+    def record(self, target, command=None):
+        '''Record the current signature of an objective, typically just after building it with `command`'''
+        if not self._loaded:
+            self.load()
+        signature = self.signature(target, command)
+        if self.targets.get(target.output) != signature:
+            self.targets[target.output] = signature
+            self._modified = True
+        self.produced(target.output, target.output)
+
+    def produced(self, owner, *paths):
+        '''Add files that were written when building the objective with the output `owner` to the manifest'''
+        if not self._loaded:
+            self.load()
+        for path in paths:
+            if self.manifest.get(path) != owner:
+                self.manifest[path] = owner
+                self._modified = True
+
+    def built_files(self):
+        '''The manifest: every file that was built, and the output of the objective it was built for'''
+        if not self._loaded:
+            self.load()
+        return self.manifest
+
+    def forget(self, path):
+        '''Forget everything about a file that was built, e.g. because it was removed'''
+        if not self._loaded:
+            self.load()
+        self.manifest.pop(path, None)
+        self.targets.pop(path, None)
+        self.deps.pop(path, None)
+        self.files.pop(path, None)
+        self._modified = True
+
+
+database = Database(STATE_FILE)
+'''The database of the current working directory'''
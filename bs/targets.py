@@ -1,11 +1,14 @@
 
+import collections
 import os
-import glob
-import subprocess
+import sys
 
 import bs
 from bs import config
+from bs import graph
 from bs import logger
+from bs import snapshot
+from bs import state
 
 
 instances = []
@@ -17,10 +20,18 @@ def save():
         instances[0].save(o_stream)
 
 
+def _path(path):
+    '''Intern a path, so that the objectives and the graph share one string per path'''
+    return sys.intern(path) if path is not None else None
+
+
 class _Target(list):
 
+    # objectives are slotted, a project may have hundreds of thousands of them
+    __slots__ = ('name', 'output')
+
     def __init__(self, name, *dependencies):
-        self.name = name
+        self.name = _path(name)
         self.output = None
         list.__init__(self)
         # if isinstance(dependencies, basestring):
@@ -49,8 +60,16 @@ class _Target(list):
 
     @property
     def needs_updating(self):
-        my_mtime = self.mtime
-        return any(my_mtime <= dep.mtime for dep in self)
+        up_to_date = state.database.up_to_date(self)
+        if up_to_date is None:
+            # never been built by bs, fall back to comparing modification times
+            my_mtime = self.mtime
+            return any(my_mtime <= bs.get_mtime(path) for path in self.inputs())
+        return not up_to_date
+
+    def inputs(self):
+        '''Paths of the files this objective is built from'''
+        return [dep.output for dep in self]
 
     def make(self):
         raise NotImplementedError
@@ -64,39 +83,49 @@ class _Target(list):
 
     def flattened_dependencies(self):
         '''This flattens until it reaches a library; theoretically a library would already be built'''
-        flat = []
-        for dep in self:
-            if isinstance(dep, LinkedObject):
-                # _Library dependencies are built into the library, so they wouldn't need to be built again
-                continue
-            flat.extend(dep.flattened_dependencies())
-        flat.append(self)
-        return flat
+        return graph.current.flatten(self)
+
+    def flattened_children(self):
+        '''Dependencies that are built along with this objective'''
+        # _Library dependencies are built into the library, so they wouldn't need to be built again
+        return [dep for dep in self if not isinstance(dep, LinkedObject)]
 
 
 class Source(_Target):
-    
+
+    __slots__ = ()
+
     def __init__(self, source):
         _Target.__init__(self, source)
-        self.output = source
+        self.output = self.name
 
 
 class _CompiledMixin(object):
 
+    # the classes that mix this in have a `links` slot
+    __slots__ = ()
+
     def __init__(self):
-        self.links = []
+        # shared until something is linked, rather than an empty list per objective
+        self.links = ()
+
+    def _own_links(self):
+        if not isinstance(self.links, list):
+            self.links = list(self.links)
+        return self.links
 
     def link_shared(self, libname):
         # self.links.extend(['-shared', '-l' + libname])
-        self.links.append('-l' + libname)
+        self._own_links().append('-l' + libname)
 
     def link_static(self, libname):
-        self.links.extend(['-static', '-l' + libname])
+        self._own_links().extend(['-static', '-l' + libname])
         # self.links.append('-l' + libname + StaticLibrary.EXT.value)
 
 
 class Object(_Target, _CompiledMixin):
 
+    __slots__ = ('links',)
 
     DIR = config.ConfigItem('--object-dir', './obj/', 'directory to generate object files')
 
@@ -112,11 +141,41 @@ class Object(_Target, _CompiledMixin):
         _Target.__init__(self, os.path.basename(source_path))
         _CompiledMixin.__init__(self)
         self.append(source_object)
-        self.output = os.path.join(self.DIR.value, source_path + self.EXT.value)
+        self.output = _path(os.path.join(self.DIR.value, source_path + self.EXT.value))
+
+    @property
+    def depfile(self):
+        '''Path of the dependency file written when compiling this object'''
+        return self.output + '.d'
+
+    @property
+    def precompiled_header(self):
+        '''The precompiled header this object is compiled with, or None (see `PrecompiledHeader.use`)'''
+        for dep in self:
+            if isinstance(dep, PrecompiledHeader):
+                return dep
+        return None
+
+    def inputs(self):
+        inputs = _Target.inputs(self)
+        for dep in self:
+            if isinstance(dep, UnitySource):
+                # the sources included by a unity source are compiled along with it
+                inputs.extend(dep.sources)
+        # headers found in the depfile when this object was last compiled, which also lists the sources
+        known = set(inputs)
+        return inputs + [dep for dep in state.database.discovered_deps(self.output) or () if dep not in known]
 
 
 class SwigSource(Source):
 
+    __slots__ = ('interface_file', 'args', 'cpp', 'target_language')
+
+    POOL = config.ConfigItem('--swig-pool', '', 'pool of the SWIG commands (see --pools)')
+
+    CACHE = config.ConfigItem('--swig-cache', 'off', 'look up and store generated SWIG wrappers in the compilation '
+            'cache (see `bs cache`), on or off')
+
     def __init__(self, interface_file, *dependencies):
         _Target.__init__(self, interface_file, *dependencies)
         self.interface_file = interface_file
@@ -127,17 +186,14 @@ class SwigSource(Source):
         self.cpp = False
         self.target_language = None
 
-    @property
-    def needs_updating(self):
-        my_mtime = self.mtime
+    def inputs(self):
         # the dependencies of a SWIG source, are the sources of the object files. Since
         # the dependencies are converted to Object(s), we need to grab their 1st dependency
         # which is the actual source file.
-        result = any(my_mtime <= dep[0].mtime for dep in self)
-        # also need to consider the interface file
-        result |= my_mtime <= os.path.getmtime(self.interface_file)
-        # yes, I realize this could have been done in one line
-        return result
+        # also need to consider the interface file, and the files it %includes or %imports
+        inputs = [self.interface_file] + [dep[0].output for dep in self]
+        known = set(inputs)
+        return inputs + [dep for dep in state.database.discovered_deps(self.output) or () if dep not in known]
 
     @property
     def name(self):
@@ -165,56 +221,225 @@ class SwigSource(Source):
     def header(self):
         return os.path.splitext(self.interface_file)[0] + '_wrap.h'
 
+    @property
+    def depfile(self):
+        '''Path of the dependency file SWIG writes, listing the interface files that were included'''
+        return self.output + '.d'
+
+    def command(self):
+        '''Get the SWIG command that generates this source'''
+        cmd = ['swig', '-{}'.format(self.target_language)]
+        if self.cpp:
+            cmd.append('-c++')
+        cmd.extend(['-o', self.name])
+        cmd.extend(['-oh', self.header])
+        cmd.extend(['-MMD', '-MF', self.depfile])
+        cmd.extend(self.args)
+        cmd.append(self.interface_file)
+        return cmd
+
     def create(self):
+        '''Generate the source with SWIG, along with whatever else is built (see `scheduler.flush`)'''
         from bs import compilers_and_linkers
+        from bs import scheduler
         if compilers_and_linkers.CLEAN:
             for ff in [self.header, self.output]:
-                if os.path.exists(ff):
+                if bs.stat(ff) is not None:
                     print('removing {}'.format(ff))
                     os.remove(ff)
-        elif self.needs_updating:
-            if self.target_language is None:
-                logger.error('You must specify a target language for a SwigSource\n'
-                        'This can be done in the `{}` file by setting the SwigSource.target_language attribute',
-                        OBJECTIVES_FILE)
-            cmd = ['swig', '-{}'.format(self.target_language)]
-            if self.cpp:
-                cmd.append('-c++')
-            cmd.extend(['-o', self.name])
-            cmd.extend(['-oh', self.header])
-            cmd.extend(self.args)
-            cmd.append(self.interface_file)
-            print(' '.join(cmd))
-            try:
-                subprocess.check_call(cmd)
-            except CalledProcessError:
-                logger.error('subprocess call failed')
+                    bs.invalidate(ff)
+            return
+        if self.target_language is None:
+            logger.error('You must specify a target language for a SwigSource\n'
+                    'This can be done in the `{}` file by setting the SwigSource.target_language attribute',
+                    OBJECTIVES_FILE)
+        scheduler.schedule(self, compilers_and_linkers.swig)
+        scheduler.flush()
+
+    def flattened_children(self):
+        return []
+
+
+class UnitySource(Source):
+    '''A generated source that includes several sources, so that they are compiled as one (see `LinkedObject.unity`)'''
+
+    __slots__ = ('sources',)
+
+    DIR = config.ConfigItem('--unity-dir', 'unity', 'directory to generate the sources of unity builds')
+
+    def __init__(self, path, sources):
+        Source.__init__(self, path)
+        self.sources = [_path(source) for source in sources]
+
+    def text(self):
+        directory = os.path.dirname(self.output)
+        return ''.join('#include "{}"\n'.format(os.path.relpath(source, directory).replace(os.sep, '/'))
+                for source in self.sources)
+
+    def create(self):
+        '''Write the source, unless it already includes the same sources'''
+        from bs import compilers_and_linkers
+        from bs import scheduler
+        snapshot.record(UnitySource.create, self)
+        if scheduler.DRY_RUN:
+            # nothing is written while the objectives are only walked, see `actions.walk_objectives`
+            return
+        if compilers_and_linkers.CLEAN:
+            if bs.stat(self.output) is not None:
+                print('removing {}'.format(self.output))
+                os.remove(self.output)
+                bs.invalidate(self.output)
+            return
+        self.write()
+
+    def write(self):
+        '''Write the source now, without recording it in the snapshot (see `create`)'''
+        state.database.produced(self.output, self.output)
+        text = self.text()
+        try:
+            with open(self.output, 'r') as stream:
+                if stream.read() == text:
+                    return
+        except (IOError, OSError):
+            directory = os.path.dirname(self.output)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+        with open(self.output, 'w') as stream:
+            stream.write(text)
+        bs.invalidate(self.output)
+
+    def flattened_children(self):
+        return []
+
+
+class PrecompiledHeader(Object):
+    '''A header that is compiled once (to `.gch` or `.pch`) and then included by the objects that `use` it.
+
+    The compiler compiles a stub in the object directory that includes the header, and objects include the stub with
+    the `pch_switch` of the compiler (`-include` for gcc and clang); the compiler then picks up the precompiled
+    header that is next to the stub instead. Should the precompiled header not be usable, e.g. because it was compiled
+    with other options, the stub is included as a plain header.
+    '''
+
+    __slots__ = ()
+
+    EXT = config.ConfigItem('--pch-ext', '.gch', 'precompiled header extension, `.gch` for gcc or `.pch` for clang')
+
+    def __init__(self, header):
+        header_path = header.output if isinstance(header, Source) else header
+        # the stub is written by the compiler, right before it compiles the precompiled header
+        stub = UnitySource(self._stub_path(header_path), [header_path])
+        Object.__init__(self, stub)
+        self.output = _path(stub.output + self.EXT.value)
+
+    @staticmethod
+    def _stub_path(header_path):
+        '''Path of the stub of a header, always in the object directory: the drive and root of an absolute header are
+        dropped and its `..` become `__`'''
+        drive, path = os.path.splitdrive(os.path.normpath(header_path))
+        path = drive.replace(':', '') + '/' + path
+        parts = ['__' if part == os.pardir else part for part in path.replace('\\', '/').split('/') if part]
+        stub_path = os.path.normpath(os.path.join(Object.DIR.value, 'pch', *parts))
+        if os.path.abspath(stub_path) == os.path.abspath(header_path):
+            logger.error('the stub of the precompiled header {} would overwrite it, change --object-dir', header_path)
+        return stub_path
+
+    @property
+    def stub(self):
+        '''The header that objects include to use the precompiled header'''
+        return self[0].output
+
+    def use(self, *objectives):
+        '''Compile objects, or the objects of linked objectives, with this precompiled header. Call this before they
+        are built.'''
+        for objective in objectives:
+            objects = [objective] if isinstance(objective, Object) else objective
+            for obj in objects:
+                if type(obj) is Object and obj.precompiled_header is None:
+                    obj.append(self)
+        return self
 
-    def flattened_dependencies(self):
-        return [self]
 
 class LinkedObject(_Target, _CompiledMixin):
 
+    __slots__ = ('links',)
+
     DIR = config.ConfigItem('--lib-dir', './bin/', 'directory to generate libraries')
     
     def __init__(self, name, *dependencies):
         _Target.__init__(self, name, *dependencies)
         _CompiledMixin.__init__(self)
-        self.output = os.path.join(self.DIR.value, self.name + self.EXT.value)
+        self.output = _path(os.path.join(self.DIR.value, self.name + self.EXT.value))
+
+    UNITY_EXTENSIONS = {'.c': '.c', '.cc': '.cpp', '.cpp': '.cpp', '.cxx': '.cpp', '.c++': '.cpp', '.C': '.cpp'}
+    '''Sources that can be merged by `unity`, and the extension of the unity source they are merged into'''
+
+    def unity(self, size=16, exclude=()):
+        '''Compile the sources of this objective in unity sources (`unity_N.c` or `unity_N.cpp`) of up to `size`
+        sources each, instead of one at a time.
+
+        Sources in `exclude` (paths, sources or objects), for instance because they define static functions with the
+        same name as another source, are still compiled on their own. Only sources compiled with the same precompiled
+        header (see `PrecompiledHeader.use`), if any, are merged. A unity source is only written again when the sources
+        it includes change. Call this before the objective is built.
+        '''
+        excluded = set()
+        for ee in exclude:
+            if isinstance(ee, Object):
+                ee = ee[0]
+            excluded.add(os.path.normpath(ee.output if isinstance(ee, Source) else ee))
+        groups = collections.OrderedDict()
+        for dep in self:
+            if not isinstance(dep, Object) or type(dep[0]) is not Source:
+                continue
+            pch = dep.precompiled_header
+            if len(dep) != (1 if pch is None else 2):
+                continue
+            source = dep[0].output
+            ext = self.UNITY_EXTENSIONS.get(os.path.splitext(source)[1])
+            if ext is not None and os.path.normpath(source) not in excluded:
+                groups.setdefault((ext, pch.output if pch is not None else None), []).append(dep)
+        replaced = {}
+        number = 0
+        for (ext, _pch_output), deps in groups.items():
+            pch = deps[0].precompiled_header
+            for index in range(0, len(deps), max(1, size)):
+                chunk = deps[index:index + max(1, size)]
+                if len(chunk) < 2:
+                    continue
+                path = os.path.join(UnitySource.DIR.value, self.name, 'unity_{}{}'.format(number, ext))
+                number += 1
+                unity_source = UnitySource(path, [dep[0].output for dep in chunk])
+                unity_source.create()
+                unity_object = Object(unity_source)
+                if pch is not None:
+                    unity_object.append(pch)
+                replaced[id(chunk[0])] = unity_object
+                for dep in chunk[1:]:
+                    replaced[id(dep)] = None
+        deps = [replaced.get(id(dep), dep) for dep in self]
+        self[:] = [dep for dep in deps if dep is not None]
+        return self
 
 
 class SharedLibrary(LinkedObject):
 
+    __slots__ = ()
+
     EXT = config.ConfigItem('--shared-library-ext', '.so', 'shared object extension')
 
 
 class StaticLibrary(LinkedObject):
 
+    __slots__ = ()
+
     EXT = config.ConfigItem('--static-library-ext', '.a', 'static library extension')
 
 
 class Executable(LinkedObject):
 
+    __slots__ = ()
+
     DIR = config.ConfigItem('--exec-dir', './bin/', 'directory to generate libraries')
 
     EXT = config.ConfigItem('--exec-ext', '.exe', 'executable file extension')
@@ -0,0 +1,106 @@
+'''How long building each objective took, used to start the objectives on the critical path first.
+
+The log is a text file that is only appended to while building, with a line `<seconds> <command digest> <output>`
+per objective that was built. The last line of an output wins, and the file is compacted when it is loaded if most of
+its lines are outdated.
+'''
+from __future__ import absolute_import
+
+import os
+
+from bs import state
+
+LOG_FILE = os.path.join(state.STATE_DIR, 'timings.log')
+
+DEFAULT_SECONDS = 1.0
+'''Estimate for an objective when nothing at all has been built yet'''
+
+_COMPACT_SLACK = 1000
+'''Outdated lines to allow in the log before it is compacted'''
+
+
+class Log(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.durations = {}
+        '''Seconds it took to build each output, and the digest of its command, by output path'''
+        self._means = None
+        self._new = []
+        self._loaded = False
+
+    def load(self):
+        self._loaded = True
+        lines = 0
+        try:
+            with open(self.path, 'r') as stream:
+                for line in stream:
+                    lines += 1
+                    try:
+                        seconds, digest, output = line.rstrip('\n').split(' ', 2)
+                        self.durations[output] = (digest, float(seconds))
+                    except ValueError:
+                        # a line that was cut short, e.g. by an interrupted build
+                        continue
+        except (IOError, OSError):
+            return
+        if lines > 2 * len(self.durations) + _COMPACT_SLACK:
+            self._compact()
+
+    def _compact(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as stream:
+            for output, (digest, seconds) in self.durations.items():
+                stream.write(_line(output, digest, seconds))
+        os.replace(temp_path, self.path)
+
+    def record(self, output, command, seconds):
+        '''Record that building `output` with `command` took `seconds`'''
+        if not self._loaded:
+            self.load()
+        digest = state.command_digest(command)[:16]
+        self.durations[output] = (digest, seconds)
+        self._new.append(_line(output, digest, seconds))
+
+    def duration(self, output, command=None):
+        '''Seconds it took to build `output` last time, None if it was never built (with `command`)'''
+        if not self._loaded:
+            self.load()
+        known = self.durations.get(output)
+        if known is None or (command is not None and known[0] != state.command_digest(command)[:16]):
+            return None
+        return known[1]
+
+    def estimate(self, output, command=None):
+        '''Seconds it will probably take to build `output` (with `command`): how long it took last time or, if it was
+        never built (with that command), the mean of the outputs with the same extension'''
+        seconds = self.duration(output, command)
+        if seconds is not None:
+            return seconds
+        if self._means is None:
+            totals = {}
+            for path, (_digest, seconds) in self.durations.items():
+                for key in (os.path.splitext(path)[1], None):
+                    total, count = totals.get(key, (0.0, 0))
+                    totals[key] = (total + seconds, count + 1)
+            self._means = {key: total / count for key, (total, count) in totals.items()}
+        return self._means.get(os.path.splitext(output)[1], self._means.get(None, DEFAULT_SECONDS))
+
+    def save(self):
+        '''Append what was recorded since the last save'''
+        if not self._new:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, 'a') as stream:
+            stream.writelines(self._new)
+        del self._new[:]
+
+
+def _line(output, digest, seconds):
+    return '{:.3f} {} {}\n'.format(seconds, digest, output)
+
+
+log = Log(LOG_FILE)
+'''The log of the current working directory'''
@@ -0,0 +1,79 @@
+'''Timeline of a build in the Chrome trace-event format, which can be opened in Perfetto or chrome://tracing.
+
+Every command gets a span with its wall time and, where `os.wait4` is available, its own user and system CPU time
+and peak memory (maximum resident set size). Each job slot is a separate lane, so running commands in parallel shows
+up as parallel lanes.
+'''
+from __future__ import absolute_import
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+ENABLED = False
+'''Whether fine grained spans (one per objective) should be recorded'''
+
+_origin = time.time()
+_events = []
+_lanes = {}
+_lock = threading.Lock()
+
+
+def now():
+    return time.time()
+
+
+def _lane():
+    ident = threading.current_thread().ident
+    lane = _lanes.get(ident)
+    if lane is None:
+        with _lock:
+            lane = _lanes.setdefault(ident, len(_lanes))
+    return lane
+
+
+def complete(name, start, end, category='bs', **args):
+    '''Record a span that started and ended at the given times (from `now`)'''
+    _events.append({
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': int((start - _origin) * 1e6),
+        'dur': int((end - start) * 1e6),
+        'pid': os.getpid(),
+        'tid': _lane(),
+        'args': args,
+    })
+
+
+@contextlib.contextmanager
+def span(name, category='bs', **args):
+    '''Record the time spent in a `with` block'''
+    start = now()
+    try:
+        yield
+    finally:
+        complete(name, start, now(), category, **args)
+
+
+def command(command, start, end, rusage=None):
+    '''Record a span for a finished command, with its resource usage if known (from `os.wait4`)'''
+    args = {'command': ' '.join(command)}
+    if rusage is not None:
+        args['user_cpu_s'] = rusage.ru_utime
+        args['system_cpu_s'] = rusage.ru_stime
+        args['max_rss_kb'] = rusage.ru_maxrss
+    complete(os.path.basename(command[0]), start, end, 'command', **args)
+
+
+def save(path):
+    '''Write the recorded spans as a trace-event file'''
+    pid = os.getpid()
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'bs'}}]
+    for ident, lane in sorted(_lanes.items(), key=lambda item: item[1]):
+        name = 'bs' if lane == 0 else 'job slot {}'.format(lane)
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': lane, 'args': {'name': name}})
+    with open(path, 'w') as stream:
+        json.dump({'traceEvents': events + _events, 'displayTimeUnit': 'ms'}, stream)
@@ -0,0 +1,238 @@
+'''Long running `bs watch`: rebuild whatever is affected as soon as a source or header changes.
+
+The objective graph, stat cache and configuration stay in memory between builds. Changes are picked up with inotify
+on Linux, and by polling the inputs everywhere else.
+'''
+from __future__ import absolute_import, print_function
+
+import collections
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import bs
+from bs import actions
+from bs import cache
+from bs import config
+from bs import graph
+from bs import logger
+from bs import scheduler
+from bs import state
+from bs import targets
+from bs import timings
+
+
+class PollingWatcher(object):
+    '''Finds changed files by comparing their size and modification time every `interval` seconds'''
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._stats = {}
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+            return st.st_size, st.st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, paths):
+        for path in paths:
+            if path not in self._stats:
+                self._stats[path] = self._stat(path)
+
+    def wait(self, timeout=None):
+        '''Get the watched paths that changed, waiting up to `timeout` seconds (forever if None)'''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            changed = set()
+            for path, previous in self._stats.items():
+                current = self._stat(path)
+                if current != previous:
+                    self._stats[path] = current
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return changed
+            time.sleep(self.interval)
+
+
+class InotifyWatcher(object):
+    '''Finds changed files with inotify, by watching the directories that contain them'''
+
+    _MASK = 0x00000008 | 0x00000080 | 0x00000200 | 0x00000040  # CLOSE_WRITE, MOVED_TO, DELETE, MOVED_FROM
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._directories = {}
+        self._watched = set()
+        self._paths = set()
+
+    def watch(self, paths):
+        for path in paths:
+            self._paths.add(path)
+            directory = os.path.dirname(path) or '.'
+            if directory in self._watched:
+                continue
+            self._watched.add(directory)
+            wd = self._libc.inotify_add_watch(self._fd, directory.encode(), self._MASK)
+            if wd < 0:
+                logger.warning('could not watch `{}`: {}', directory, os.strerror(ctypes.get_errno()))
+                continue
+            self._directories[wd] = directory
+
+    def wait(self, timeout=None):
+        '''Get the watched paths that changed, waiting up to `timeout` seconds (forever if None)'''
+        changed = set()
+        readable, _w, _x = select.select([self._fd], [], [], timeout)
+        while readable:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, _mask, _cookie, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+                directory = self._directories.get(wd)
+                if directory is not None:
+                    path = os.path.normpath(os.path.join(directory, name))
+                    if path in self._paths:
+                        changed.add(path)
+            readable, _w, _x = select.select([self._fd], [], [], 0)
+        return changed
+
+
+def make_watcher(poll=False, interval=0.5):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as ee:
+            logger.warning('inotify is not available ({}), falling back to polling', ee)
+    return PollingWatcher(interval)
+
+
+class _Index(object):
+    '''Which objectives use each file, and which objectives depend on each objective'''
+
+    def __init__(self):
+        dag = graph.current
+        self.users = collections.defaultdict(set)
+        self.dependents = collections.defaultdict(set)
+        outputs = set()
+        for node in dag.runners:
+            item = dag.nodes[node]
+            outputs.add(os.path.normpath(item.output))
+            for path in item.inputs():
+                self.users[os.path.normpath(path)].add(node)
+            for child in dag.children(node):
+                self.dependents[child].add(node)
+        self.sources = set(path for path in self.users if path not in outputs)
+        '''Inputs that are not built by bs, i.e. what needs to be watched'''
+
+    def affected(self, paths):
+        '''Nodes that use any of the paths, and everything downstream of them'''
+        todo = [node for path in paths for node in self.users.get(path, ())]
+        affected = set()
+        while todo:
+            node = todo.pop()
+            if node not in affected:
+                affected.add(node)
+                todo.extend(self.dependents.get(node, ()))
+        return affected
+
+
+class Watch(actions.Action):
+
+    def __init__(self):
+        actions.Action.__init__(self,
+                'watch',
+                'build, then keep rebuilding whatever is affected when a source or header changes')
+
+    def add_arguments(self, parser):
+        scheduler.add_arguments(parser)
+        parser.add_argument('--debounce',
+                help='seconds without further changes to wait for before building',
+                type=float,
+                default=0.2)
+        parser.add_argument('--poll',
+                help='poll for changes instead of using inotify',
+                action='store_true')
+        parser.add_argument('--interval',
+                help='seconds between polls',
+                type=float,
+                default=0.5)
+
+    def invoke(self, args):
+        scheduler.configure(args)
+        scheduler.KEEP_GOING = True
+        reevaluate = set(os.path.normpath(path) for path in [targets.OBJECTIVES_FILE, config.CONFIG_NAME])
+        watcher = make_watcher(args.poll, args.interval)
+        self._build(actions.evaluate_objectives)
+        index = _Index()
+        watcher.watch(sorted(index.sources | reevaluate))
+        print('watching {} files for changes'.format(len(index.sources)))
+        self._waiting()
+        while True:
+            changed = watcher.wait()
+            # debounce, so that saving many files at once results in a single build
+            while True:
+                more = watcher.wait(args.debounce)
+                if not more:
+                    break
+                changed |= more
+            if changed & reevaluate:
+                print('{} changed, restarting'.format(', '.join(sorted(changed & reevaluate))))
+                sys.stdout.flush()
+                os.execv(sys.executable, [sys.executable, '-m', 'bs'] + sys.argv[1:])
+            for path in changed:
+                bs.invalidate(path)
+            affected = index.affected(changed)
+            if not affected:
+                continue
+            self._build(lambda: self._rebuild(affected))
+            # rebuilding may have discovered new headers
+            index = _Index()
+            watcher.watch(sorted(index.sources))
+            self._waiting()
+
+    def _rebuild(self, nodes):
+        dag = graph.current
+        with scheduler.batch():
+            for node in sorted(nodes):
+                scheduler.schedule(dag.nodes[node], dag.runners[node], dag.pools.get(node))
+
+    def _build(self, function):
+        del scheduler.failed[:]
+        scheduler.open_log()
+        try:
+            function()
+        except SystemExit:
+            pass
+        finally:
+            scheduler.close_log()
+            state.database.save()
+            timings.log.save()
+            cache.finish()
+        if scheduler.failed:
+            logger.warning('{} objective(s) could not be built:\n  {}',
+                    len(scheduler.failed), '\n  '.join(item.output for item in scheduler.failed))
+
+    def _waiting(self):
+        print('waiting for changes...')
+        sys.stdout.flush()
+
+
+def get_actions():
+    return [Watch()]
@@ -0,0 +1,4 @@
+'''Benchmarks of bs itself, on generated projects that are built with fake tools.
+
+Run them with `python -m bs_bench`, see `python -m bs_bench --help`.
+'''
@@ -0,0 +1,251 @@
+'''Benchmark bs on a generated project and save the results as JSON.
+
+    python -m bs_bench --output results.json
+    python -m bs_bench --output new.json --compare results.json
+
+Graph construction (time and memory), flattening and `needs_updating` sweeps are measured in this process; full and
+no-op builds run `python -m bs build` in the generated project. Every measurement is the best of `--repeat` runs.
+'''
+from __future__ import absolute_import, print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bs
+from bs import graph
+from bs import state
+from bs import targets
+from bs_bench import project
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SLOWER = 1.1
+'''Ratio to the previous results above which a measurement is reported as a regression'''
+
+BUDGETS = {
+    'startup_version_s': 0.05,
+    'startup_noop_build_s': 0.15,
+}
+'''Seconds that `bs --version` and a no-op build of an empty project may take, on top of starting Python'''
+
+
+def _best(function, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _fresh_graph():
+    graph.reset()
+    del targets.instances[:]
+
+
+def _fresh_state():
+    state.database = state.Database(state.STATE_FILE)
+    bs.clear_stats()
+
+
+def _version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=_ROOT,
+                stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class _Project(object):
+
+    def __init__(self, directory, jobs):
+        self.directory = directory
+        self.jobs = jobs
+        self.env = dict(os.environ)
+        self.env['PYTHONPATH'] = os.pathsep.join([_ROOT] + [path for path in [os.environ.get('PYTHONPATH')] if path])
+        self.env['PATH'] = os.pathsep.join([os.path.join(directory, 'tools'), os.environ.get('PATH', '')])
+
+    def clean(self):
+        for name in ['obj', 'bin', state.STATE_DIR]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        swig_dir = os.path.join(self.directory, 'swig')
+        for name in os.listdir(swig_dir) if os.path.isdir(swig_dir) else []:
+            if not name.endswith('.i'):
+                os.remove(os.path.join(swig_dir, name))
+
+    def build(self, *args):
+        command = [sys.executable, '-m', 'bs', 'build', '-j', str(self.jobs)] + list(args)
+        with open(os.devnull, 'w') as devnull:
+            if subprocess.call(command, cwd=self.directory, env=self.env, stdout=devnull) != 0:
+                sys.exit('bs build failed in {}'.format(self.directory))
+
+
+def _scheduling_overhead(trace_path, wall):
+    '''Seconds of a build that the busiest job slot was not running a command, and the number of commands'''
+    with open(trace_path) as stream:
+        events = json.load(stream)['traceEvents']
+    busy = {}
+    commands = 0
+    for event in events:
+        if event.get('cat') == 'command':
+            commands += 1
+            busy[event['tid']] = busy.get(event['tid'], 0) + event['dur'] / 1e6
+    return wall - max(busy.values() or [0]), commands
+
+
+def startup(repeat):
+    '''Time `bs --version` and a no-op build of an empty project, minus the time to start Python'''
+    results = {}
+    directory = tempfile.mkdtemp(prefix='bs_bench')
+    try:
+        open(os.path.join(directory, targets.OBJECTIVES_FILE), 'w').close()
+        bench = _Project(directory, 1)
+        python = _best(lambda: subprocess.call([sys.executable, '-c', 'pass']), repeat)
+        version = [sys.executable, '-m', 'bs', '--version']
+        results['startup_version_s'] = _best(
+                lambda: subprocess.call(version, env=bench.env, stdout=subprocess.DEVNULL), repeat) - python
+        results['startup_noop_build_s'] = _best(bench.build, repeat) - python
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def run(directory, jobs, repeat):
+    results = startup(repeat)
+    spec = project.load(os.path.join(directory, project.SPEC_FILE))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        results['graph_construction_s'] = _best(lambda: project.define(spec), repeat, _fresh_graph)
+        linked = []
+
+        def define():
+            _fresh_graph()
+            linked[:] = project.define(spec)[1]
+
+        def flatten():
+            for objective in linked:
+                objective.flattened_dependencies()
+
+        results['flatten_s'] = _best(flatten, repeat, define)
+        results['objectives'] = len(graph.current.nodes)
+        _fresh_graph()
+        tracemalloc.start()
+        try:
+            define()
+            flatten()
+            results['graph_memory_mb'] = tracemalloc.get_traced_memory()[0] / 1e6
+        finally:
+            tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+
+    bench = _Project(directory, jobs)
+    trace_path = os.path.join(directory, 'trace.json')
+    walls = []
+
+    def full_build():
+        start = time.perf_counter()
+        bench.build('--trace', trace_path)
+        walls.append(time.perf_counter() - start)
+
+    results['full_build_s'] = _best(full_build, repeat, bench.clean)
+    overhead, commands = _scheduling_overhead(trace_path, walls[-1])
+    results['commands'] = commands
+    results['scheduling_overhead_per_command_ms'] = 1000.0 * overhead / max(1, commands)
+    results['noop_build_s'] = _best(bench.build, repeat)
+    results['noop_build_no_snapshot_s'] = _best(lambda: bench.build('--no-snapshot'), repeat)
+
+    os.chdir(directory)
+    try:
+        define()
+        flatten()
+        items = [item for item in graph.current.nodes if not isinstance(item, targets.Source)]
+
+        def sweep():
+            return [item for item in items if item.needs_updating]
+
+        results['needs_updating_sweep_s'] = _best(sweep, repeat, _fresh_state)
+        stale = sweep()
+        if stale:
+            print('warning: {} objectives are out of date after a build, e.g. {}'.format(len(stale), stale[0].output))
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def compare(current, previous):
+    print('{:<40} {:>12} {:>12} {:>8}'.format('measurement', 'previous', 'current', 'ratio'))
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if not old or not name.endswith(('_s', '_ms', '_mb')):
+            continue
+        ratio = value / old
+        print('{:<40} {:>12.4f} {:>12.4f} {:>7.2f}x{}'.format(name, old, value, ratio,
+                '  slower' if ratio > _SLOWER else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bs_bench', description=__doc__.split('\n')[0])
+    parser.add_argument('--output', '-o', help='file to save the results to', default='bench_results.json')
+    parser.add_argument('--compare', help='previous results to compare with', metavar='PATH')
+    parser.add_argument('--directory', help='where to generate the project, a temporary directory by default')
+    parser.add_argument('--keep', help='do not remove the generated project', action='store_true')
+    parser.add_argument('--repeat', help='number of runs of every measurement', type=int, default=3)
+    parser.add_argument('--check-budget', help='exit with an error if startup is over its budget',
+            action='store_true')
+    parser.add_argument('--jobs', '-j', help='jobs of the builds', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--sources', type=int, default=2000)
+    parser.add_argument('--libraries', type=int, default=40)
+    parser.add_argument('--depth', help='length of the chains of libraries', type=int, default=8)
+    parser.add_argument('--headers', type=int, default=200)
+    parser.add_argument('--includes', help='headers included by each source', type=int, default=5)
+    parser.add_argument('--shared', help='sources that are part of several libraries', type=int, default=20)
+    parser.add_argument('--wrappers', help='SWIG wrapped libraries', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    parameters = {name: getattr(args, name) for name in
+            ['sources', 'libraries', 'depth', 'headers', 'includes', 'shared', 'wrappers', 'jobs', 'repeat']}
+    directory = args.directory or tempfile.mkdtemp(prefix='bs_bench')
+    try:
+        project.generate(directory, **{name: parameters[name] for name in
+                ['sources', 'libraries', 'depth', 'headers', 'includes', 'shared', 'wrappers']})
+        results = run(directory, args.jobs, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    document = {
+        'version': _version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': parameters,
+        'results': results,
+    }
+    with open(args.output, 'w') as stream:
+        json.dump(document, stream, indent=2, sort_keys=True)
+    for name, value in sorted(results.items()):
+        print('{:<40} {}'.format(name, round(value, 4) if isinstance(value, float) else value))
+    if args.compare:
+        with open(args.compare) as stream:
+            compare(results, json.load(stream)['results'])
+    over = [name for name, budget in sorted(BUDGETS.items()) if results[name] > budget]
+    for name in over:
+        print('{} is over its budget: {:.4f} > {}'.format(name, results[name], BUDGETS[name]))
+    if over and args.check_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
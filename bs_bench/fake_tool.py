@@ -0,0 +1,83 @@
+'''Stands in for the compiler, linker and swig of a generated project.
+
+The output is a hash of the inputs, and of the headers they include when compiling, so it only changes when an input
+does. A depfile is written for `-MF`, and `-E` writes the preprocessed input to stdout. Set `BS_BENCH_TOOL_SECONDS`
+to make every call take (at least) that long, like a real tool would.
+'''
+from __future__ import print_function
+
+import hashlib
+import os
+import re
+import sys
+import time
+
+_INCLUDE = re.compile(br'^#include "([^"]+)"', re.MULTILINE)
+
+
+def _find(include, include_dirs):
+    for directory in include_dirs:
+        path = os.path.join(directory, include)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def main(argv):
+    output = header = depfile = None
+    preprocess = False
+    include_dirs = []
+    inputs = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '-o':
+            output = next(args)
+        elif arg == '-oh':
+            header = next(args)
+        elif arg == '-MF':
+            depfile = next(args)
+        elif arg == '-E':
+            preprocess = True
+        elif arg.startswith('-I'):
+            include_dirs.append(arg[2:])
+        elif arg.startswith('-o'):
+            output = arg[2:]
+        elif not arg.startswith('-'):
+            inputs.append(arg)
+
+    hasher = hashlib.md5()
+    headers = []
+    for path in inputs:
+        with open(path, 'rb') as stream:
+            data = stream.read()
+        hasher.update(data)
+        for include in _INCLUDE.findall(data):
+            found = _find(include.decode(), include_dirs)
+            if found is not None and found not in headers:
+                headers.append(found)
+    for path in headers:
+        with open(path, 'rb') as stream:
+            hasher.update(stream.read())
+
+    seconds = float(os.environ.get('BS_BENCH_TOOL_SECONDS', 0))
+    if seconds:
+        time.sleep(seconds)
+
+    if preprocess:
+        sys.stdout.write(hasher.hexdigest() + '\n')
+        return 0
+    if output is None:
+        print('fake_tool: no output given', file=sys.stderr)
+        return 1
+    for path in [output, header]:
+        if path is not None:
+            with open(path, 'w') as stream:
+                stream.write(hasher.hexdigest() + '\n')
+    if depfile is not None:
+        with open(depfile, 'w') as stream:
+            stream.write('{}: {}\n'.format(output, ' '.join(inputs + headers)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
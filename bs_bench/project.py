@@ -0,0 +1,143 @@
+'''Synthetic projects to benchmark bs with.
+
+A project is a `core` static library, chains of `depth` libraries (alternating static and shared) that each depend on
+the previous library of their chain, the first one on `core`, and an executable that depends on the last library of
+every chain; so every chain is a diamond with `core` at the bottom. Some sources are shared by several libraries,
+and some libraries are wrapped with SWIG. Every source includes a few of the project headers.
+
+The layout is saved to `bench.json`, which the generated objectives file passes to `define`.
+'''
+from __future__ import absolute_import
+
+import json
+import os
+import random
+import stat
+import sys
+
+from bs import builders
+from bs import compilers_and_linkers
+from bs import targets
+
+SPEC_FILE = 'bench.json'
+
+TOOL = os.path.join('tools', 'fake')
+
+_OBJECTIVES = '''\
+from bs_bench import project
+from bs import scheduler
+
+swigs, linked = project.define(project.load())
+for swig in swigs:
+    swig.create()
+builder = project.builder()
+with scheduler.batch():
+    for objective in linked:
+        builder.build(objective)
+'''
+
+
+def _write(path, text):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as stream:
+        stream.write(text)
+
+
+def _source(name, headers):
+    lines = ['#include "{}"'.format(header) for header in headers]
+    lines.append('int {}(void) {{ return 0; }}'.format(name))
+    return '\n'.join(lines) + '\n'
+
+
+def generate(directory, sources=2000, libraries=40, depth=8, headers=200, includes=5, shared=20, wrappers=4,
+        seed=0):
+    '''Write a project to `directory`, returns its layout (what is saved to `bench.json`)'''
+    rng = random.Random(seed)
+    header_names = ['h{}.h'.format(index) for index in range(headers)]
+    for name in header_names:
+        _write(os.path.join(directory, 'include', name), 'int {}(void);\n'.format(name[:-2]))
+
+    def write_source(path):
+        name = os.path.splitext(path)[0].replace('/', '_')
+        _write(os.path.join(directory, path), _source(name, rng.sample(header_names, min(includes, headers))))
+        return path
+
+    common = [write_source('src/common/c{}.c'.format(index)) for index in range(shared)]
+    names = ['core'] + ['lib{}_{}'.format(index // depth, index % depth) for index in range(libraries)]
+    per_library = max(1, sources // len(names))
+    spec = {'libraries': [], 'swig': [], 'executable': None}
+    tails = []
+    for index, name in enumerate(names):
+        library_sources = [write_source('src/{}/s{}.c'.format(name, number)) for number in range(per_library)]
+        if common:
+            library_sources.extend(rng.sample(common, min(2, len(common))))
+        if index == 0:
+            depends, kind = [], 'static'
+        else:
+            position = (index - 1) % depth
+            depends = ['core'] if position == 0 else [names[index - 1]]
+            kind = 'static' if position % 2 == 0 else 'shared'
+            if position == depth - 1 or index == len(names) - 1:
+                tails.append(name)
+        spec['libraries'].append({'name': name, 'kind': kind, 'sources': library_sources, 'depends': depends})
+
+    for index in range(wrappers):
+        library = spec['libraries'][index % len(names)]
+        interface = 'swig/mod{}.i'.format(index)
+        _write(os.path.join(directory, interface), '%module mod{}\n'.format(index))
+        spec['swig'].append({'name': '_mod{}'.format(index), 'interface': interface,
+                'sources': library['sources'][:3], 'library': library['name']})
+
+    spec['executable'] = {'name': 'app', 'sources': [write_source('src/main.c')], 'depends': tails or ['core']}
+
+    _write(os.path.join(directory, SPEC_FILE), json.dumps(spec, indent=1))
+    _write(os.path.join(directory, targets.OBJECTIVES_FILE), _OBJECTIVES)
+    tool = os.path.join(directory, TOOL)
+    with open(os.path.join(os.path.dirname(__file__), 'fake_tool.py')) as stream:
+        _write(tool, '#!{}\n'.format(sys.executable) + stream.read())
+    os.chmod(tool, os.stat(tool).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    swig = os.path.join(directory, 'tools', 'swig')
+    if not os.path.exists(swig):
+        os.symlink('fake', swig)
+    return spec
+
+
+def load(path=SPEC_FILE):
+    with open(path) as stream:
+        return json.load(stream)
+
+
+def define(spec):
+    '''Create the objectives of a project, returns its SWIG sources and its linked objectives, dependencies first'''
+    linked = {}
+    swigs = []
+    for library in spec['libraries']:
+        kind = targets.StaticLibrary if library['kind'] == 'static' else targets.SharedLibrary
+        dependencies = library['sources'] + [linked[name] for name in library['depends']]
+        linked[library['name']] = kind(library['name'], *dependencies)
+    for wrapper in spec['swig']:
+        swig = targets.SwigSource(wrapper['interface'], *wrapper['sources'])
+        swig.target_language = 'python'
+        swigs.append(swig)
+        linked[wrapper['name']] = targets.SharedLibrary(wrapper['name'], targets.Object(swig),
+                linked[wrapper['library']])
+    executable = spec['executable']
+    dependencies = executable['sources'] + [linked[name] for name in executable['depends']]
+    linked[executable['name']] = targets.Executable(executable['name'], *dependencies)
+    return swigs, list(linked.values())
+
+
+def builder():
+    '''A builder that uses the fake tool as compiler and linker'''
+    compiler = compilers_and_linkers.Compiler('bench-c', TOOL)
+    compiler.options = ['-c', '-Iinclude']
+    compiler.output_switch = '-o'
+    compiler.depfile_options = ['-MMD', '-MF']
+    linker = compilers_and_linkers.Linker('bench-ld', TOOL)
+    linker.output_switch = '-o'
+    bench = builders.Builder('bench')
+    bench.compiler = compiler
+    bench.linker = linker
+    return bench
@@ -0,0 +1,74 @@
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import bs
+from bs import actions
+from bs import graph
+from bs import state
+from bs import targets
+
+
+class TestActions(unittest.TestCase):
+
+    def test_everyActionIsRegistered(self):
+        for module in set(actions.ACTIONS.values()):
+            for action in importlib.import_module(module).get_actions():
+                self.assertEqual(module, actions.ACTIONS.get(action.name), action.name)
+
+    def test_find(self):
+        self.assertEqual('watch', actions.find('watch').name)
+        self.assertIsNone(actions.find('no-such-action'))
+
+
+OBJECTIVES = '''
+from bs import targets
+exe = targets.Executable('exe', 'a.c')
+'''
+
+
+class TestClean(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        with open(targets.OBJECTIVES_FILE, 'w') as stream:
+            stream.write(OBJECTIVES)
+        for path in ['a.c', 'b.c']:
+            open(path, 'w').close()
+        os.makedirs('obj')
+        for item in [bs.Object('a.c'), bs.Object('b.c')]:
+            open(item.output, 'w').close()
+            state.database.record(item)
+        state.database.save()
+        state.database = state.Database(state.STATE_FILE)
+        del targets.instances[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        del targets.instances[:]
+
+    def test_cleanRemovesManifest(self):
+        actions.find('clean').invoke(None)
+        self.assertEqual(['a.c', 'b.c'], sorted(path for path in os.listdir('.') if path.endswith('.c')))
+        self.assertEqual([], os.listdir('obj'))
+        self.assertEqual({}, state.Database(state.STATE_FILE).built_files())
+
+    def test_gcRemovesOrphans(self):
+        actions.find('gc').invoke(None)
+        self.assertEqual(['a.c.obj'], os.listdir('obj'))
+        self.assertEqual(['./obj/a.c.obj'], list(state.Database(state.STATE_FILE).built_files()))
+
+    def test_gcDoesNotWriteOrCopy(self):
+        with open(targets.OBJECTIVES_FILE, 'a') as stream:
+            stream.write("targets.Executable('unity', 'a.c', 'b.c').unity()\nimport bs\nbs.copy('a.c', 'copy.c')\n")
+        actions.find('gc').invoke(None)
+        self.assertFalse(os.path.exists(targets.UnitySource.DIR.value))
+        self.assertFalse(os.path.exists('copy.c'))
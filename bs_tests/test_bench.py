@@ -0,0 +1,31 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from bs_bench import project
+
+
+class TestBenchProject(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        project.generate(self.tmp, sources=6, libraries=2, depth=2, headers=4, includes=2, shared=1, wrappers=1)
+        self.env = dict(os.environ)
+        self.env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(project.__file__)))
+        self.env['PATH'] = os.pathsep.join([os.path.join(self.tmp, 'tools'), os.environ.get('PATH', '')])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def build(self):
+        return subprocess.check_output([sys.executable, '-m', 'bs', 'build', '-j', '2'], cwd=self.tmp,
+                env=self.env, stderr=subprocess.STDOUT).decode()
+
+    def test_buildsThenNoop(self):
+        self.assertIn('app.exe', self.build())
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'bin', 'app.exe')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'bin', '_mod0.so')))
+        self.assertNotIn('tools/fake', self.build())
@@ -0,0 +1,53 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bs import cache
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        cache.DIR.value = os.path.join(self.tmp, 'cache')
+        self.output = os.path.join(self.tmp, 'a.o')
+        with open(self.output, 'w') as stream:
+            stream.write('object')
+
+    def tearDown(self):
+        cache.DIR.value = None
+        cache.SIZE.value = None
+        shutil.rmtree(self.tmp)
+
+    def test_parseSize(self):
+        self.assertEqual(500 << 20, cache.parse_size('500M'))
+        self.assertEqual(3 << 29, cache.parse_size('1.5g'))
+        self.assertEqual(1024, cache.parse_size(1024))
+
+    def test_storeAndLookup(self):
+        cache.store('abcdef', self.output, ['a.h', 'b.h'])
+        os.remove(self.output)
+        self.assertIsNone(cache.lookup('012345', self.output))
+        self.assertEqual(['a.h', 'b.h'], cache.lookup('abcdef', self.output))
+        with open(self.output) as stream:
+            self.assertEqual('object', stream.read())
+
+    def test_manifestChecksDependencies(self):
+        digests = {'a.h': '1', 'b.h': '2'}
+        cache.remember('ffffff', [('a.h', '1'), ('b.h', '2')], 'abcdef')
+        self.assertEqual('abcdef', cache.find('ffffff', digests.get))
+        digests['b.h'] = '3'
+        self.assertIsNone(cache.find('ffffff', digests.get))
+        self.assertIsNone(cache.find('eeeeee', digests.get))
+
+    def test_trimEvictsLeastRecentlyUsed(self):
+        cache.store('aaaaaa', self.output, [])
+        cache.store('bbbbbb', self.output, [])
+        old = os.path.join(cache.DIR.value, 'aa', 'aaaaaa')
+        os.utime(old, (1, 1))
+        cache.SIZE.value = '8'
+        cache.trim()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(os.path.join(cache.DIR.value, 'bb', 'bbbbbb')))
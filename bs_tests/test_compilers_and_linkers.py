@@ -0,0 +1,325 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import bs
+from bs import compilers_and_linkers
+from bs import graph
+from bs import scheduler
+from bs import state
+
+FAKE_COMPILER = '''
+import os, sys
+status = 0
+outputs = [arg[2:] for arg in sys.argv[1:] if arg.startswith('-o')]
+for arg in sys.argv[1:]:
+    if arg.startswith('-'):
+        continue
+    if 'bad' in arg:
+        status = 1
+        continue
+    open(outputs[0] if outputs else os.path.splitext(os.path.basename(arg))[0] + '.o', 'w').close()
+    if '-MMD' in sys.argv:
+        open(os.path.splitext(os.path.basename(arg))[0] + '.d', 'w').close()
+sys.exit(status)
+'''
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        with open('fake_cc.py', 'w') as stream:
+            stream.write(FAKE_COMPILER)
+        for name in ['a.c', 'b.c', 'bad.c', 'd.c']:
+            open(name, 'w').close()
+        self.compiler = compilers_and_linkers.Compiler('batch-test', sys.executable)
+        self.compiler.options = ['fake_cc.py', '-c']
+        self.compiler.output_switch = '-o'
+        self.compiler.batch_size = 8
+        scheduler.JOBS = 1
+        scheduler.KEEP_GOING = True
+        del scheduler.failed[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        scheduler.KEEP_GOING = False
+        del scheduler.failed[:]
+        del compilers_and_linkers.compilers['batch-test']
+
+    def test_failuresAreAttributed(self):
+        objects = [bs.Object(name) for name in ['a.c', 'b.c', 'bad.c', 'd.c']]
+        with scheduler.batch():
+            for item in objects:
+                scheduler.schedule(item, self.compiler)
+        self.assertEqual(['./obj/bad.c.obj'], [item.output for item in scheduler.failed])
+        for item in objects:
+            self.assertEqual(item.output != './obj/bad.c.obj', os.path.exists(item.output))
+        self.assertFalse(os.path.exists('a.o'))
+
+    def test_depfilesAreNotLeftBehind(self):
+        self.compiler.batch_options = ['-MMD']
+        objects = [bs.Object(name) for name in ['a.c', 'b.c', 'bad.c', 'd.c']]
+        with scheduler.batch():
+            for item in objects:
+                scheduler.schedule(item, self.compiler)
+        self.assertEqual(['./obj/bad.c.obj'], [item.output for item in scheduler.failed])
+        for name in ['a.d', 'b.d', 'bad.d', 'd.d']:
+            self.assertFalse(os.path.exists(name))
+
+    def test_sameNameIsCompiledAlone(self):
+        with open('a.o', 'w') as stream:
+            stream.write('not ours')
+        items = [bs.Object('a.c'), bs.Object('b.c')]
+        os.makedirs('obj')
+        commands = [self.compiler.command_for(item) for item in items]
+        # `a.o` is in the way, so a.c is compiled on its own, with its own command
+        self.assertEqual([True, True], self.compiler.execute_batch(items, commands))
+        with open('a.o') as stream:
+            self.assertEqual('not ours', stream.read())
+        self.assertTrue(os.path.exists('./obj/a.c.obj'))
+        self.assertTrue(os.path.exists('./obj/b.c.obj'))
+
+
+FAKE_CACHED_COMPILER = '''
+import sys
+args = sys.argv[1:]
+source = [arg for arg in args if arg.endswith('.c')][0]
+text = open(source).read()
+includes = [line.split('"')[1] for line in text.splitlines() if line.startswith('#include')]
+expanded = ''.join(open(path).read() for path in includes) + text
+if '-E' in args:
+    sys.stdout.write(expanded)
+    sys.exit(0)
+with open('cc.log', 'a') as stream:
+    stream.write(source + '\\n')
+with open([arg[2:] for arg in args if arg.startswith('-o')][0], 'w') as stream:
+    stream.write(expanded)
+with open(args[args.index('-MF') + 1], 'w') as stream:
+    stream.write('out: ' + ' '.join([source] + includes) + '\\n')
+'''
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        from bs import cache
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        cache.DIR.value = os.path.join(self.tmp, 'cache')
+        with open('fake_cc.py', 'w') as stream:
+            stream.write(FAKE_CACHED_COMPILER)
+        self.compiler = compilers_and_linkers.Compiler('cache-test', sys.executable)
+        self.compiler.options = [os.path.abspath('fake_cc.py'), '-c']
+        self.compiler.output_switch = '-o'
+        self.compiler.depfile_options = ['-MMD', '-MF']
+        self.compiler.cache = True
+
+    def tearDown(self):
+        from bs import cache
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        cache.DIR.value = None
+        del compilers_and_linkers.compilers['cache-test']
+
+    def _compile(self, source):
+        with open('a.c', 'w') as stream:
+            stream.write(source)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        item = bs.Object('a.c')
+        scheduler.schedule(item, self.compiler)
+        scheduler.flush()
+        state.database.save()
+        with open(item.output) as stream:
+            return stream.read()
+
+    def test_headersOfCachedObjectAreChecked(self):
+        with_header = '#include "h.h"\n'
+        with open('h.h', 'w') as stream:
+            stream.write('10\n')
+        self.assertEqual('a\n', self._compile('a\n'))
+        self.assertEqual('10\n' + with_header, self._compile(with_header))
+        with open('h.h', 'w') as stream:
+            stream.write('20\n')
+        self.assertEqual('a\n', self._compile('a\n'))
+        self.assertEqual('20\n' + with_header, self._compile(with_header))
+        with open('cc.log') as stream:
+            self.assertEqual(3, len(stream.readlines()))
+
+
+FAKE_ARCHIVER = '''#!{}
+import sys
+modifiers, archive, members = sys.argv[1], sys.argv[2], sys.argv[3:]
+with open('ar.log', 'a') as stream:
+    stream.write(' '.join(sys.argv[1:]) + '\\n')
+if modifiers[0] in 'qr':
+    with open(archive, 'a') as stream:
+        stream.write(' '.join(members) + '\\n')
+'''
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        with open('fake_ar', 'w') as stream:
+            stream.write(FAKE_ARCHIVER.format(sys.executable))
+        os.chmod('fake_ar', 0o755)
+        self.linker = compilers_and_linkers.Linker('archive-test', 'ld')
+        self.linker.archiver = os.path.abspath('fake_ar')
+        self.lib = bs.StaticLibrary('lib', 'a.c', 'b.c', 'c.c')
+        os.makedirs('obj')
+        for obj in self.lib:
+            with open(obj.output, 'w') as stream:
+                stream.write('object\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        del compilers_and_linkers.linkers['archive-test']
+
+    def _archive(self):
+        scheduler.schedule(self.lib, self.linker)
+        scheduler.flush()
+        with open('ar.log') as stream:
+            return stream.read().splitlines()
+
+    def test_onlyChangedMembersAreReplaced(self):
+        self.assertEqual(['qcs ./bin/lib.a ./obj/a.c.obj ./obj/b.c.obj ./obj/c.c.obj'], self._archive())
+        with open(self.lib[1].output, 'w') as stream:
+            stream.write('changed object\n')
+        bs.invalidate(self.lib[1].output)
+        self.assertEqual(['rS ./bin/lib.a ./obj/b.c.obj', 's ./bin/lib.a'], self._archive()[1:])
+
+    def test_verbosePrintsCommandsThatRun(self):
+        self._archive()
+        with open(self.lib[1].output, 'w') as stream:
+            stream.write('changed object\n')
+        bs.invalidate(self.lib[1].output)
+        stdout = io.StringIO()
+        scheduler.VERBOSE = True
+        try:
+            with contextlib.redirect_stdout(stdout):
+                self._archive()
+        finally:
+            scheduler.VERBOSE = False
+        self.assertEqual(['{} rS ./bin/lib.a ./obj/b.c.obj'.format(self.linker.archiver),
+                '{} s ./bin/lib.a'.format(self.linker.archiver)], stdout.getvalue().splitlines())
+
+    def test_otherMembersAreArchivedFromScratch(self):
+        self._archive()
+        self.lib.pop()
+        self.linker.thin_archive = True
+        self.assertEqual(['qcTs ./bin/lib.a ./obj/a.c.obj ./obj/b.c.obj'], self._archive()[1:])
+
+
+FAKE_SWIG = '''#!{}
+import sys
+args = sys.argv[1:]
+interface = args[-1]
+includes = [line.split('"')[1] for line in open(interface) if line.startswith('%include')]
+rule = 'wrap: ' + ' '.join([interface] + includes) + '\\n'
+with open('swig.log', 'a') as stream:
+    stream.write(interface + '\\n')
+for switch in ['-o', '-oh']:
+    with open(args[args.index(switch) + 1], 'w') as stream:
+        stream.write(''.join(open(path).read() for path in [interface] + includes))
+with open(args[args.index('-MF') + 1], 'w') as stream:
+    stream.write(rule)
+'''
+
+
+class TestSwig(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = os.environ['PATH']
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        os.makedirs('tools')
+        with open(os.path.join('tools', 'swig'), 'w') as stream:
+            stream.write(FAKE_SWIG.format(sys.executable))
+        os.chmod(os.path.join('tools', 'swig'), 0o755)
+        os.environ['PATH'] = os.path.abspath('tools') + os.pathsep + self.path
+        with open('lib.i', 'w') as stream:
+            stream.write('%include "types.i"\n')
+        with open('types.i', 'w') as stream:
+            stream.write('int a;\n')
+        open('b.c', 'w').close()
+        bs.SwigSource.CACHE.value = 'on'
+        from bs import cache
+        cache.DIR.value = os.path.join(self.tmp, 'cache')
+
+    def tearDown(self):
+        from bs import cache
+        os.environ['PATH'] = self.path
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        bs.SwigSource.CACHE.value = None
+        cache.DIR.value = None
+
+    def _generate(self):
+        swig = bs.SwigSource('lib.i', 'b.c')
+        swig.target_language = 'python'
+        swig.create()
+        state.database.save()
+        bs.clear_stats()
+        with open('swig.log') as stream:
+            return len(stream.readlines())
+
+    def test_includedInterfaceIsTracked(self):
+        self.assertEqual(1, self._generate())
+        self.assertEqual(('types.i',), state.database.discovered_deps('lib_wrap.c'))
+        self.assertEqual(1, self._generate())
+        with open('types.i', 'w') as stream:
+            stream.write('int b;\n')
+        self.assertEqual(2, self._generate())
+
+    def test_cached(self):
+        self.assertEqual(1, self._generate())
+        for path in ['lib_wrap.c', 'lib_wrap.h', state.STATE_FILE]:
+            if os.path.exists(path):
+                os.remove(path)
+        state.database = state.Database(state.STATE_FILE)
+        self.assertEqual(1, self._generate())
+        with open('lib_wrap.h') as stream:
+            self.assertEqual('%include "types.i"\nint a;\n', stream.read())
+
+    def test_cachedIncludesAreChecked(self):
+        with open('lib.i', 'w') as stream:
+            stream.write('int x;\n')
+        self._generate()
+        with open('lib.i', 'w') as stream:
+            stream.write('%include "types.i"\n')
+        self.assertEqual(2, self._generate())
+        with open('lib.i', 'w') as stream:
+            stream.write('int x;\n')
+        with open('types.i', 'w') as stream:
+            stream.write('int b;\n')
+        self.assertEqual(2, self._generate())
+        with open('lib.i', 'w') as stream:
+            stream.write('%include "types.i"\n')
+        self.assertEqual(3, self._generate())
+        with open('lib_wrap.h') as stream:
+            self.assertEqual('%include "types.i"\nint b;\n', stream.read())
@@ -0,0 +1,51 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from bs import config
+
+
+class TestConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        with open(config.CONFIG_NAME, 'w') as stream:
+            stream.write('--bench-item: from-yaml\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        config._values.clear()
+        config.loaded = None
+
+    def test_cachedUntilChanged(self):
+        self.assertEqual({'--bench-item': 'from-yaml'}, config._read())
+        self.assertTrue(os.path.exists(config.CACHE_FILE))
+        with open(config.CONFIG_NAME, 'w') as stream:
+            stream.write('--bench-item: changed\n')
+        self.assertEqual({'--bench-item': 'changed'}, config._read())
+
+    def test_itemCreatedAfterLoad(self):
+        config.load()
+        item = config.ConfigItem('--bench-item', 'default', 'not defined when the configuration was loaded')
+        try:
+            self.assertEqual('from-yaml', item.value)
+        finally:
+            config.items.remove(item)
+            del config._by_name[item.name]
+
+    def test_noopBuildDoesNotImportCommandRunners(self):
+        with open(config.CONFIG_NAME, 'a') as stream:
+            stream.write('compilers:\n  c:\n    function: c\n    command: cc\n')
+        open('objectives.py', 'w').close()
+        script = ('import runpy, sys\nsys.argv = ["bs", "build"]\nrunpy.run_module("bs", run_name="__main__")\n'
+                'print(" ".join(name for name in ["asyncio", "socketserver"] if name in sys.modules))')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(config.__file__))))
+        for _build in range(2):
+            output = subprocess.check_output([sys.executable, '-c', script], env=env).decode()
+            self.assertEqual('', output.splitlines()[-1])
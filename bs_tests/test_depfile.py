@@ -0,0 +1,45 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bs import depfile
+
+
+class TestParse(unittest.TestCase):
+
+    def test_continuationLines(self):
+        deps = depfile.parse('obj/a.c.obj: a.c inc/a.h \\\n  inc/b.h\n')
+        self.assertEqual(['a.c', 'inc/a.h', 'inc/b.h'], deps)
+
+    def test_escapes(self):
+        deps = depfile.parse('a.o: my\\ file.h $$HOME.h\n')
+        self.assertEqual(['my file.h', '$HOME.h'], deps)
+
+    def test_phonyTargetsAreIgnored(self):
+        deps = depfile.parse('a.o: a.c a.h\n\na.h:\n')
+        self.assertEqual(['a.c', 'a.h'], deps)
+
+    def test_driveLetters(self):
+        deps = depfile.parse('C:\\obj\\a.obj: C:\\src\\a.c')
+        self.assertEqual(['C:\\src\\a.c'], deps)
+
+
+class TestRead(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'a.o.d')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_readExcludesSourceAndRemovesDepfile(self):
+        with open(self.path, 'w') as stream:
+            stream.write('a.o: ./a.c ./inc/a.h inc/a.h\n')
+        self.assertEqual(['inc/a.h'], depfile.read(self.path, exclude=['a.c']))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_missingDepfile(self):
+        self.assertIsNone(depfile.read(self.path))
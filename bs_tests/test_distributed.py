@@ -0,0 +1,126 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+import bs
+from bs import compilers_and_linkers
+from bs import distributed
+from bs import graph
+from bs import scheduler
+from bs import state
+
+FAKE_COMPILER = '''
+import sys
+args = sys.argv[1:]
+source = [arg for arg in args if not arg.startswith('-')][0]
+if '-E' in args:
+    sys.stdout.write(open(source).read())
+else:
+    output = [arg[2:] for arg in args if arg.startswith('-o')][0]
+    open(output, 'w').write('compiled ' + source.split('/')[-1])
+    sys.stderr.write('warning: compiled ' + source.split('/')[-1] + '\\n')
+'''
+
+
+class TestDistributed(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        with open('fake_cc.py', 'w') as stream:
+            stream.write(FAKE_COMPILER)
+        with open('a.c', 'w') as stream:
+            stream.write('int a;\n')
+        os.makedirs('obj')
+        self.compiler = compilers_and_linkers.Compiler('distributed-test', sys.executable)
+        self.compiler.options = [os.path.abspath('fake_cc.py'), '-c']
+        self.compiler.output_switch = '-o'
+        self.compiler.distributed = True
+        self.server = distributed.Server(('127.0.0.1', 0), 2, [sys.executable])
+        threading.Thread(target=self.server.serve_forever).start()
+        distributed._workers = None
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        distributed.WORKERS.value = None
+        distributed._workers = None
+        del compilers_and_linkers.compilers['distributed-test']
+
+    def _compile(self):
+        item = bs.Object('a.c')
+        self.assertTrue(self.compiler.execute(item, self.compiler.command_for(item)))
+        with open(item.output) as stream:
+            return stream.read()
+
+    def test_compiledOnWorker(self):
+        distributed.WORKERS.value = ['127.0.0.1:{}'.format(self.server.server_address[1])]
+        self.assertEqual('compiled input.i', self._compile())
+
+    def test_outputIsReported(self):
+        distributed.WORKERS.value = ['127.0.0.1:{}'.format(self.server.server_address[1])]
+        path = os.path.join(self.tmp, 'output.log.gz')
+        scheduler.open_log(path)
+        stdout = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                self._compile()
+        finally:
+            scheduler.close_log()
+        self.assertEqual('warning: compiled input.i\n', stdout.getvalue())
+        with gzip.open(path, 'rb') as stream:
+            self.assertIn('# on 127.0.0.1:', stream.read().decode('utf-8'))
+
+    def test_unreachableWorkerFallsBack(self):
+        self.server.shutdown()
+        distributed.WORKERS.value = ['127.0.0.1:{}'.format(self.server.server_address[1])]
+        self.server.server_close()
+        self.assertEqual('compiled a.c', self._compile())
+
+    def test_otherCompilerIsNotSent(self):
+        distributed.WORKERS.value = ['127.0.0.1:{}'.format(self.server.server_address[1])]
+        self.server.allowed = set(['cc'])
+        self.assertEqual('compiled a.c', self._compile())
+
+    def test_unsafeOptionIsCompiledLocally(self):
+        distributed.WORKERS.value = ['127.0.0.1:{}'.format(self.server.server_address[1])]
+        self.compiler.options.append('-B/tmp')
+        self.assertEqual('compiled a.c', self._compile())
+
+    def test_workerRefusesUnsafeOptions(self):
+        for arg in ['-wrapper', '-fplugin=evil.so', '-B/tmp', '@args', '-o/tmp/evil']:
+            sock = socket.create_connection(self.server.server_address)
+            with sock:
+                distributed.send(sock, {'request': 'compile', 'args': [sys.executable, arg, '-c', '<input>',
+                        '-o<output>'], 'ext': '.i'}, b'int a;\n')
+                header, payload = distributed.receive(sock)
+            self.assertEqual(1, header['status'])
+            self.assertEqual('bs worker: `{}` is not allowed\n'.format(arg), header['output'])
+            self.assertEqual(b'', payload)
+
+    def test_unreachableWorkerWarnsOnce(self):
+        self.server.shutdown()
+        distributed.WORKERS.value = ['127.0.0.1:{}'.format(self.server.server_address[1])]
+        self.server.server_close()
+        worker = distributed._Worker(distributed._address(distributed.WORKERS.value[0]))
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            # jobs that found the worker before it was known to be unreachable
+            worker.hello(sys.executable)
+            worker.hello(sys.executable)
+            worker.fail('failed', EOFError('connection closed'))
+        self.assertEqual(1, stdout.getvalue().count('WARNING'))
+        self.assertFalse(worker.reachable)
@@ -0,0 +1,57 @@
+
+import unittest
+
+import bs
+from bs import graph
+from bs import targets
+
+
+class Step(targets._Target):
+
+    def __init__(self, name, *dependencies):
+        targets._Target.__init__(self, name, *dependencies)
+        self.output = name
+
+
+class TestGraph(unittest.TestCase):
+
+    def setUp(self):
+        graph.reset()
+
+    def test_sameOutputIsSameNode(self):
+        one = bs.Object('a.c')
+        two = bs.Object('a.c')
+        self.assertEqual(graph.current.add(one), graph.current.add(two))
+        self.assertIs(one, graph.current.canonical(two))
+
+    def test_nodeIdsAreStable(self):
+        exe = bs.Executable('exe', 'a.c', 'b.c')
+        self.assertEqual(0, graph.current.add(exe))
+        self.assertEqual(1, graph.current.add(exe[0]))
+
+    def test_childrenAreNodeIds(self):
+        exe = bs.Executable('exe', 'a.c', bs.Object('./b.c'))
+        node = graph.current.add(exe)
+        self.assertEqual([1, 2], list(graph.current.children(node)))
+        self.assertEqual(2, graph.current.add(bs.Object('b.c')))
+
+    def test_diamondIsFlattenedOnce(self):
+        shared = bs.Object('shared.c')
+        left = bs.StaticLibrary('left', shared, 'left.c')
+        right = bs.StaticLibrary('right', bs.Object('shared.c'), 'right.c')
+        flat = bs.Executable('exe', *(list(left) + list(right))).flattened_dependencies()
+        outputs = [item.output for item in flat]
+        self.assertEqual(len(set(outputs)), len(outputs))
+        self.assertEqual(1, outputs.count(shared.output))
+        self.assertTrue(outputs.index(shared.output) < outputs.index('./bin/exe.exe'))
+
+    def test_librariesAreNotFlattened(self):
+        lib = bs.StaticLibrary('lib', 'lib.c')
+        exe = bs.Executable('exe', lib, 'main.c')
+        self.assertNotIn(lib.output, [item.output for item in exe.flattened_dependencies()])
+
+    def test_deepChainIsNotRecursive(self):
+        item = bs.Object('leaf.c')
+        for ii in range(5000):
+            item = Step('step{}'.format(ii), item)
+        self.assertEqual(5002, len(item.flattened_dependencies()))
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import bs
+from bs import compilers_and_linkers
+from bs import graph
+from bs import ninja
+from bs import scheduler
+from bs import state
+
+OBJECTIVES = '''
+from bs import compilers_and_linkers, targets
+exe = targets.Executable('exe', 'a.c', 'b.c')
+lib = targets.SharedLibrary('lib', 'b.c')
+swig = targets.SwigSource('lib.i', 'b.c')
+swig.target_language = 'python'
+compiler = compilers_and_linkers.get_compiler('ninja-cc')
+for item in exe:
+    compiler.run(item)
+compilers_and_linkers.get_linker('ninja-ld').run(exe)
+compilers_and_linkers.get_linker('ninja-ld').run(lib, 'link')
+swig.create()
+'''
+
+
+class TestNinja(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        graph.reset()
+        with open('objectives.py', 'w') as stream:
+            stream.write(OBJECTIVES)
+        self.compiler = compilers_and_linkers.Compiler('ninja-cc', 'gcc')
+        self.compiler.options = ['-c']
+        self.compiler.output_switch = '-o'
+        self.compiler.depfile_options = ['-MMD', '-MF']
+        self.linker = compilers_and_linkers.Linker('ninja-ld', 'gcc')
+        self.linker.output_switch = '-o'
+        scheduler.POOLS.value = ['link=1']
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        scheduler.POOLS.value = None
+        del compilers_and_linkers.compilers['ninja-cc']
+        del compilers_and_linkers.linkers['ninja-ld']
+
+    def _generate(self):
+        ninja.generate()
+        with open(ninja.NINJA_FILE) as stream:
+            return stream.read()
+
+    def test_rulesAndBuilds(self):
+        text = self._generate()
+        self.assertIn('pool link\n  depth = 1\n', text)
+        self.assertIn('rule compile_ninja_cc\n  command = gcc -c $in -o$out -MMD -MF $out.d $pch\n', text)
+        self.assertIn('  deps = gcc\n', text)
+        self.assertIn('build obj/a.c.obj: compile_ninja_cc a.c\n', text)
+        self.assertIn('build bin/exe.exe: link_ninja_ld obj/a.c.obj obj/b.c.obj\n', text)
+        self.assertIn('build bin/lib.so: link_ninja_ld obj/b.c.obj\n  pool = link\n', text)
+        self.assertIn('build build.ninja: regenerate objectives.py\n', text)
+        self.assertIn('default bin/exe.exe bin/lib.so\n', text)
+        # nothing was built
+        self.assertFalse(os.path.exists('obj'))
+
+    def test_swig(self):
+        text = self._generate()
+        self.assertIn('build lib_wrap.c | lib_wrap.h: swig lib.i | b.c\n  flags = -python\n', text)
+
+    def test_copy(self):
+        open('a.c', 'w').close()
+        with open('objectives.py', 'a') as stream:
+            stream.write("import bs\nbs.copy('a.c', 'copy.c')\n")
+        text = self._generate()
+        self.assertIn('build copy.c: copy a.c\n', text)
+        self.assertIn('default bin/exe.exe bin/lib.so copy.c\n', text)
+        self.assertFalse(os.path.exists('copy.c'))
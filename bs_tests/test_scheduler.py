@@ -0,0 +1,260 @@
+
+import argparse
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import bs
+from bs import graph
+from bs import scheduler
+from bs import state
+from bs import timings
+
+
+class FakeRunner(object):
+    '''Writes the output of an objective, or fails for the outputs in `failures`.'''
+
+    def __init__(self, *failures):
+        self.failures = failures
+        self.commands = []
+
+    def command_for(self, item):
+        if item.output in self.failures:
+            return [sys.executable, '-c', 'exit(1)']
+        return [sys.executable, '-c', 'import sys; open(sys.argv[1], "w").close()', item.output]
+
+    def batch_key(self, item):
+        return None
+
+    def execute(self, item, command):
+        self.commands.append(item.output)
+        return scheduler.call(command)
+
+    def finish(self, item):
+        pass
+
+
+class ConcurrencyRunner(FakeRunner):
+    '''Counts how many commands are running at the same time'''
+
+    def __init__(self, pool=None):
+        FakeRunner.__init__(self)
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+
+    def command_for(self, item):
+        return [sys.executable, '-c', 'import sys, time; time.sleep(0.05); open(sys.argv[1], "w").close()',
+                item.output]
+
+    def execute(self, item, command):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        try:
+            return scheduler.call(command)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        timings.log = timings.Log(timings.LOG_FILE)
+        bs.clear_stats()
+        graph.reset()
+        for name in ['a.c', 'b.c', 'c.c']:
+            open(name, 'w').close()
+        scheduler.JOBS = 4
+        scheduler.KEEP_GOING = False
+        del scheduler.failed[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        scheduler.JOBS = 1
+        scheduler.MIN_FREE_MEMORY = None
+        scheduler.POOLS.value = None
+        del scheduler.failed[:]
+
+    def _schedule(self, runner, *roots):
+        for root in roots:
+            for item in root.flattened_dependencies():
+                if not isinstance(item, bs.Source):
+                    scheduler.schedule(item, runner)
+
+    def test_linksAfterObjects(self):
+        runner = FakeRunner()
+        exe = bs.Executable('exe', 'a.c', 'b.c', 'c.c')
+        self._schedule(runner, exe)
+        scheduler.flush()
+        self.assertEqual(exe.output, runner.commands[-1])
+        self.assertEqual(4, len(runner.commands))
+        self.assertFalse(exe.needs_updating)
+
+    def test_sharedObjectIsBuiltOnce(self):
+        runner = FakeRunner()
+        shared = bs.Object('a.c')
+        one = bs.Executable('one', shared, 'b.c')
+        two = bs.Executable('two', shared, 'c.c')
+        with scheduler.batch():
+            self._schedule(runner, one, two)
+        self.assertEqual(1, runner.commands.count(shared.output))
+        self.assertEqual(5, len(runner.commands))
+
+    def test_equivalentObjectsAreBuiltOnce(self):
+        runner = FakeRunner()
+        one = bs.Executable('one', 'a.c', 'b.c')
+        two = bs.Executable('two', 'a.c', 'c.c')
+        with scheduler.batch():
+            self._schedule(runner, one, two)
+        self.assertEqual(1, runner.commands.count(one[0].output))
+        self.assertEqual(5, len(runner.commands))
+
+    def test_failureStopsTheBuild(self):
+        runner = FakeRunner(os.path.join(bs.Object.DIR.value, 'a.c' + bs.Object.EXT.value))
+        scheduler.JOBS = 1
+        exe = bs.Executable('exe', 'a.c', 'b.c', 'c.c')
+        self._schedule(runner, exe)
+        with self.assertRaises(SystemExit):
+            scheduler.flush()
+        self.assertNotIn(exe.output, runner.commands)
+
+    def test_keepGoingSkipsDependents(self):
+        runner = FakeRunner(os.path.join(bs.Object.DIR.value, 'a.c' + bs.Object.EXT.value))
+        scheduler.KEEP_GOING = True
+        exe = bs.Executable('exe', 'a.c', 'b.c')
+        other = bs.Executable('other', 'c.c')
+        self._schedule(runner, exe, other)
+        scheduler.flush()
+        self.assertEqual([id(exe[0]), id(exe)], [id(item) for item in scheduler.failed])
+        self.assertNotIn(exe.output, runner.commands)
+        self.assertTrue(os.path.exists(other.output))
+
+    def test_poolLimitsCommands(self):
+        scheduler.POOLS.value = ['link=1']
+        objects = ConcurrencyRunner()
+        links = ConcurrencyRunner('link')
+        exes = [bs.Executable(name, name + '.c') for name in ['a', 'b', 'c']]
+        with scheduler.batch():
+            for exe in exes:
+                scheduler.schedule(exe[0], objects)
+                scheduler.schedule(exe, links)
+        self.assertEqual(1, links.most)
+        self.assertEqual(3, objects.most)
+        self.assertTrue(all(os.path.exists(exe.output) for exe in exes))
+
+    def test_unknownPool(self):
+        scheduler.schedule(bs.Object('a.c'), FakeRunner(), 'link')
+        with self.assertRaises(SystemExit):
+            scheduler.flush()
+
+    def test_lowMemoryThrottles(self):
+        if scheduler.available_memory() is None:
+            self.skipTest('available memory is unknown')
+        scheduler.MIN_FREE_MEMORY = 1 << 60
+        runner = ConcurrencyRunner()
+        with scheduler.batch():
+            for name in ['a.c', 'b.c', 'c.c']:
+                scheduler.schedule(bs.Object(name), runner)
+        self.assertEqual(1, runner.most)
+        self.assertFalse(scheduler.failed)
+
+    def test_longestPathStartsFirst(self):
+        scheduler.JOBS = 1
+        runner = FakeRunner()
+        exes = [bs.Executable(name, name + '.c') for name in ['a', 'b', 'c']]
+        for exe, compile_seconds, link_seconds in zip(exes, [1.0, 10.0, 1.0], [1.0, 1.0, 5.0]):
+            timings.log.record(exe[0].output, runner.command_for(exe[0]), compile_seconds)
+            timings.log.record(exe.output, runner.command_for(exe), link_seconds)
+        with scheduler.batch():
+            self._schedule(runner, *exes)
+        self.assertEqual([exes[1][0].output, exes[2][0].output], runner.commands[:2])
+        self.assertEqual(6, len(timings.log.durations))
+
+
+class TestArguments(unittest.TestCase):
+
+    def tearDown(self):
+        scheduler.JOBS = 1
+        scheduler.VERBOSE = False
+        scheduler.MAX_LOAD = None
+        scheduler.MIN_FREE_MEMORY = None
+
+    def test_configure(self):
+        parser = argparse.ArgumentParser()
+        scheduler.add_arguments(parser)
+        scheduler.configure(parser.parse_args(['-j', '3', '-v', '--max-load', '2.5', '--min-free-memory', '1K']))
+        self.assertEqual((3, True, 2.5, 1024),
+                (scheduler.JOBS, scheduler.VERBOSE, scheduler.MAX_LOAD, scheduler.MIN_FREE_MEMORY))
+
+
+class TestCall(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        scheduler.close_log()
+        shutil.rmtree(self.tmp)
+
+    def _call(self, code):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            ok = scheduler.call([sys.executable, '-c', code])
+        return ok, stdout.getvalue()
+
+    def test_outputIsPrintedAsOneBlock(self):
+        ok, output = self._call('import sys; print("one"); sys.stderr.write("two\\n")')
+        self.assertTrue(ok)
+        self.assertEqual('one\ntwo\n', output)
+
+    def test_failureShowsCommand(self):
+        ok, output = self._call('import sys; print("oops"); sys.exit(2)')
+        self.assertFalse(ok)
+        self.assertTrue(output.startswith('FAILED: {} -c'.format(sys.executable)))
+        self.assertTrue(output.endswith('oops\n'))
+
+    def test_log(self):
+        path = os.path.join(self.tmp, 'output.log.gz')
+        scheduler.open_log(path)
+        self.assertFalse(os.path.exists(path))
+        self._call('pass')
+        self._call('print("logged")')
+        scheduler.close_log()
+        with gzip.open(path, 'rb') as stream:
+            log = stream.read().decode('utf-8')
+        self.assertIn('logged\n[exit status 0]\n', log)
+        self.assertIn('$ {} -c pass\n[exit status 0]\n'.format(sys.executable), log)
+
+    def test_capture(self):
+        path = os.path.join(self.tmp, 'output.log.gz')
+        scheduler.open_log(path)
+        stdout = io.StringIO()
+        scheduler.VERBOSE = True
+        try:
+            with contextlib.redirect_stdout(stdout):
+                output = scheduler.capture([sys.executable, '-c', 'import sys; print("out"); sys.stderr.write("err\\n")'])
+                failed = scheduler.capture([sys.executable, '-c', 'import sys; print("out"); sys.exit(1)'])
+        finally:
+            scheduler.VERBOSE = False
+        scheduler.close_log()
+        self.assertEqual(b'out\n', output.replace(b'\r\n', b'\n'))
+        self.assertIsNone(failed)
+        # the commands are echoed, their output is not printed
+        self.assertEqual(2, len(stdout.getvalue().splitlines()))
+        self.assertTrue(all(line.startswith(sys.executable) for line in stdout.getvalue().splitlines()))
+        with gzip.open(path, 'rb') as stream:
+            self.assertIn('err\n[exit status 0]\n', stream.read().decode('utf-8'))
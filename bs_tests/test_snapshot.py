@@ -0,0 +1,72 @@
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import bs
+from bs import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        with open('objectives.py', 'w') as stream:
+            stream.write('# objectives\n')
+        snapshot.start()
+        snapshot.record(os.makedirs, 'replayed')
+        snapshot.save('objectives.py', '.bs.yaml')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_replay(self):
+        self.assertTrue(snapshot.replay('objectives.py', '.bs.yaml'))
+        self.assertTrue(os.path.isdir('replayed'))
+
+    def test_changedInputInvalidates(self):
+        with open('objectives.py', 'a') as stream:
+            stream.write('# more objectives\n')
+        self.assertFalse(snapshot.replay('objectives.py', '.bs.yaml'))
+        self.assertFalse(os.path.exists('replayed'))
+
+    def test_newConfigInvalidates(self):
+        open('.bs.yaml', 'w').close()
+        self.assertFalse(snapshot.replay('objectives.py', '.bs.yaml'))
+
+    def test_notRecordingByDefault(self):
+        snapshot.record(os.makedirs, 'not-recorded')
+        snapshot.save('objectives.py')
+        self.assertTrue(snapshot.replay('objectives.py', '.bs.yaml'))
+
+    def test_otherVersionInvalidates(self):
+        version = bs.__version__
+        bs.__version__ = version + '.dev'
+        try:
+            self.assertFalse(snapshot.replay('objectives.py', '.bs.yaml'))
+        finally:
+            bs.__version__ = version
+
+    def test_failedReplayIsDiscarded(self):
+        snapshot.start()
+        snapshot.record(os.makedirs, 'replayed')
+        snapshot.record(os.makedirs, 'replayed')
+        snapshot.save('objectives.py', '.bs.yaml')
+        self.assertFalse(snapshot.replay('objectives.py', '.bs.yaml'))
+        self.assertFalse(os.path.exists(snapshot.SNAPSHOT_FILE))
+
+    def test_runnersAreFromConfiguration(self):
+        from bs import compilers_and_linkers
+        compiler = compilers_and_linkers.Compiler('snapshot-test', 'cc')
+        try:
+            data = pickle.dumps((compiler, compilers_and_linkers.swig))
+            replacement = compilers_and_linkers.Compiler('snapshot-test', 'clang')
+            self.assertEqual((replacement, compilers_and_linkers.swig), pickle.loads(data))
+        finally:
+            del compilers_and_linkers.compilers['snapshot-test']
+        self.assertRaises(KeyError, pickle.loads, data)
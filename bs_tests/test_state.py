@@ -0,0 +1,114 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import bs
+from bs import state
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        bs.clear_stats()
+        with open('a.c', 'w') as stream:
+            stream.write('int a;\n')
+        self.obj = bs.Object('a.c')
+        os.makedirs(os.path.dirname(self.obj.output))
+        with open(self.obj.output, 'w') as stream:
+            stream.write('object\n')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def _age(self, path, seconds):
+        mtime = os.path.getmtime(path) + seconds
+        os.utime(path, (mtime, mtime))
+        bs.invalidate(path)
+
+    def test_unrecordedObjectiveFallsBackToMtime(self):
+        self.assertIsNone(state.database.up_to_date(self.obj))
+        self._age('a.c', 10)
+        self.assertTrue(self.obj.needs_updating)
+
+    def test_touchedInputIsUpToDate(self):
+        state.database.record(self.obj)
+        self._age('a.c', 10)
+        self.assertFalse(self.obj.needs_updating)
+
+    def test_modifiedInputNeedsUpdating(self):
+        state.database.record(self.obj)
+        with open('a.c', 'w') as stream:
+            stream.write('int b;\n')
+        bs.invalidate('a.c')
+        self.assertTrue(self.obj.needs_updating)
+
+    def test_missingOutputNeedsUpdating(self):
+        state.database.record(self.obj)
+        os.remove(self.obj.output)
+        bs.invalidate(self.obj.output)
+        self.assertTrue(self.obj.needs_updating)
+
+    def test_savedAndLoaded(self):
+        self._age('a.c', -10)
+        self._age(self.obj.output, -10)
+        state.database.record(self.obj)
+        state.database.save()
+        loaded = state.Database(state.STATE_FILE)
+        self.assertTrue(loaded.up_to_date(self.obj))
+        self.assertIn('a.c', loaded.files)
+
+    def test_recentFilesAreNotSaved(self):
+        state.database.record(self.obj)
+        state.database.save()
+        loaded = state.Database(state.STATE_FILE)
+        loaded.load()
+        self.assertNotIn('a.c', loaded.files)
+        self.assertTrue(loaded.up_to_date(self.obj))
+
+    def test_commandChanged(self):
+        state.database.record(self.obj, ['gcc', '-c', 'a.c'])
+        self.assertFalse(state.database.command_changed(self.obj, ['gcc', '-c', 'a.c']))
+        self.assertTrue(state.database.command_changed(self.obj, ['gcc', '-O3', '-c', 'a.c']))
+
+    def test_unchangedOutputKeepsMtime(self):
+        self._age(self.obj.output, -10)
+        mtime = os.path.getmtime(self.obj.output)
+        previous = state.database.previous(self.obj.output)
+        with open(self.obj.output, 'w') as stream:
+            stream.write('object\n')
+        self.assertTrue(state.database.restore_mtime(self.obj.output, previous))
+        self.assertEqual(mtime, os.path.getmtime(self.obj.output))
+        self.assertEqual(mtime, bs.get_mtime(self.obj.output))
+
+    def test_changedOutputIsNotRestored(self):
+        self._age(self.obj.output, -10)
+        mtime = os.path.getmtime(self.obj.output)
+        previous = state.database.previous(self.obj.output)
+        with open(self.obj.output, 'w') as stream:
+            stream.write('other object\n')
+        self.assertFalse(state.database.restore_mtime(self.obj.output, previous))
+        self.assertNotEqual(mtime, os.path.getmtime(self.obj.output))
+
+    def test_newOutputIsStatedAgain(self):
+        self.assertIsNone(state.database.previous('a_wrap.h'))
+        open('a_wrap.h', 'w').close()
+        self.assertFalse(state.database.restore_mtime('a_wrap.h', None))
+        self.assertIsNotNone(bs.stat('a_wrap.h'))
+
+    def test_inputListedTwice(self):
+        lib = bs.StaticLibrary('lib', 'a.c')
+        exe = bs.Executable('exe', lib, lib)
+        os.makedirs(os.path.dirname(exe.output))
+        for item in [lib, exe]:
+            with open(item.output, 'w') as stream:
+                stream.write('linked\n')
+            state.database.record(item)
+        self.assertFalse(exe.needs_updating)
+        self.assertEqual([], state.database.changed_inputs(exe))
@@ -1,5 +1,9 @@
 
 import os
+import pickle
+import shutil
+import sys
+import tempfile
 import unittest
 
 import bs
@@ -19,4 +23,166 @@ class TestSource(unittest.TestCase):
         self.assertEqual(src.mtime, -1)
 
 
+class TestCompact(unittest.TestCase):
 
+    def test_noInstanceDict(self):
+        for item in [bs.Source('a.c'), bs.Object('a.c'), bs.Executable('exe', 'a.c'), bs.SwigSource('a.i')]:
+            self.assertFalse(hasattr(item, '__dict__'), item)
+
+    def test_pathsAreInterned(self):
+        one = bs.Object('dir/' + 'a.c')
+        two = bs.Object('dir/a' + '.c')
+        self.assertIs(one.output, two.output)
+        self.assertIs(one[0].output, two[0].output)
+
+    def test_linksAreNotShared(self):
+        one = bs.Object('a.c')
+        two = bs.Object('b.c')
+        one.link_shared('m')
+        self.assertEqual(['-lm'], one.links)
+        self.assertEqual(0, len(two.links))
+
+    def test_pickled(self):
+        exe = bs.Executable('exe', 'a.c')
+        exe.link_static('m')
+        copy = pickle.loads(pickle.dumps(exe, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((exe.name, exe.output, exe.links), (copy.name, copy.output, copy.links))
+        self.assertEqual(exe[0].output, copy[0].output)
+
+
+class TestStatCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        bs.clear_stats()
+        open('thing.cpp', 'w').close()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        bs.clear_stats()
+
+    def test_scannedDirectoryKnowsMissingFiles(self):
+        bs.scan('.')
+        open('new.cpp', 'w').close()
+        self.assertIsNotNone(bs.stat('thing.cpp'))
+        self.assertIsNone(bs.stat('./new.cpp'))
+
+    def test_invalidateRestats(self):
+        bs.scan('.')
+        open('new.cpp', 'w').close()
+        bs.invalidate('new.cpp')
+        self.assertIsNotNone(bs.stat('new.cpp'))
+
+    def test_mtimeIsCached(self):
+        mtime = bs.get_mtime('thing.cpp')
+        os.utime('thing.cpp', (mtime + 10, mtime + 10))
+        self.assertEqual(mtime, bs.get_mtime('thing.cpp'))
+        bs.invalidate('thing.cpp')
+        self.assertEqual(mtime + 10, bs.get_mtime('thing.cpp'))
+
+
+class TestUnity(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        bs.clear_stats()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        bs.clear_stats()
+
+    def test_sourcesAreMerged(self):
+        exe = bs.Executable('exe', 'a.c', 'b.c', 'c.c', 'd.cpp', 'e.cpp', 'f.f90').unity(2)
+        self.assertEqual(['unity_0.c', 'c.c', 'unity_1.cpp', 'f.f90'], [dep.name for dep in exe])
+        with open(os.path.join('unity', 'exe', 'unity_0.c')) as stream:
+            self.assertEqual('#include "../../a.c"\n#include "../../b.c"\n', stream.read())
+        self.assertEqual(['unity/exe/unity_0.c', 'a.c', 'b.c'], exe[0].inputs())
+
+    def test_excluded(self):
+        exe = bs.Executable('exe', 'a.c', 'b.c', 'c.c').unity(4, exclude=['b.c'])
+        self.assertEqual(['unity_0.c', 'b.c'], [dep.name for dep in exe])
+
+    def test_precompiledHeaderIsKept(self):
+        pch = bs.PrecompiledHeader('common.h')
+        exe = bs.Executable('exe', 'a.c', 'b.c', 'c.c')
+        pch.use(exe[0], exe[1])
+        exe.unity()
+        self.assertEqual(['unity_0.c', 'c.c'], [dep.name for dep in exe])
+        self.assertIs(pch, exe[0].precompiled_header)
+        self.assertIsNone(exe[1].precompiled_header)
+
+    def test_unchangedIsNotWritten(self):
+        bs.Executable('exe', 'a.c', 'b.c').unity()
+        path = os.path.join('unity', 'exe', 'unity_0.c')
+        os.utime(path, (1, 1))
+        bs.Executable('exe', 'a.c', 'b.c').unity()
+        self.assertEqual(1, os.path.getmtime(path))
+        bs.Executable('exe', 'a.c', 'c.c').unity()
+        self.assertNotEqual(1, os.path.getmtime(path))
+
+
+class TestPrecompiledHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        bs.clear_stats()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        bs.clear_stats()
+
+    def test_stubIncludesHeader(self):
+        from bs import compilers_and_linkers
+        pch = bs.PrecompiledHeader('include/common.h')
+        self.assertEqual(os.path.join('obj', 'pch', 'include', 'common.h'), pch.stub)
+        self.assertEqual(pch.stub + '.gch', pch.output)
+        # evaluating the objectives does not write anything, compiling the precompiled header does
+        self.assertFalse(os.path.exists(pch.stub))
+        compiler = compilers_and_linkers.Compiler('pch-test', 'g++')
+        try:
+            self.assertTrue(compiler.execute(pch, [sys.executable, '-c', 'pass']))
+        finally:
+            del compilers_and_linkers.compilers['pch-test']
+        with open(pch.stub) as stream:
+            self.assertEqual('#include "../../../include/common.h"\n', stream.read())
+        self.assertIn('include/common.h', pch.inputs())
+
+    def test_absoluteHeaderIsNotOverwritten(self):
+        header = os.path.abspath('common.h')
+        with open(header, 'w') as stream:
+            stream.write('int common;\n')
+        pch = bs.PrecompiledHeader(header)
+        self.assertEqual(os.path.join('obj', 'pch'), os.path.commonpath([pch.stub, os.path.join('obj', 'pch')]))
+        pch[0].write()
+        with open(header) as stream:
+            self.assertEqual('int common;\n', stream.read())
+        with open(pch.stub) as stream:
+            self.assertEqual('#include "{}"\n'.format(os.path.relpath(header, os.path.dirname(pch.stub))),
+                    stream.read())
+
+    def test_parentHeaderStaysInObjectDirectory(self):
+        pch = bs.PrecompiledHeader('../../x.h')
+        self.assertEqual(os.path.join('obj', 'pch', '__', '__', 'x.h'), pch.stub)
+
+    def test_use(self):
+        from bs import compilers_and_linkers
+        exe = bs.Executable('exe', 'a.cpp', 'b.cpp')
+        pch = bs.PrecompiledHeader('common.h').use(exe)
+        self.assertIs(pch, exe[0].precompiled_header)
+        self.assertIn(pch.output, exe[1].inputs())
+        compiler = compilers_and_linkers.Compiler('pch-test', 'g++')
+        try:
+            command = compiler.command_for(exe[0])
+        finally:
+            del compilers_and_linkers.compilers['pch-test']
+        self.assertNotIn(pch.output, command)
+        self.assertEqual(['-include', pch.stub], command[-2:])
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bs import timings
+
+
+class TestLog(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_lastDurationIsLoaded(self):
+        log = timings.Log(timings.LOG_FILE)
+        log.record('obj/a.c.obj', ['cc', 'a.c'], 2.0)
+        log.record('obj/a.c.obj', ['cc', '-O2', 'a.c'], 3.0)
+        log.save()
+        log = timings.Log(timings.LOG_FILE)
+        self.assertEqual(3.0, log.duration('obj/a.c.obj'))
+        self.assertEqual(3.0, log.duration('obj/a.c.obj', ['cc', '-O2', 'a.c']))
+        self.assertIsNone(log.duration('obj/a.c.obj', ['cc', 'a.c']))
+
+    def test_unknownIsEstimatedByExtension(self):
+        log = timings.Log(timings.LOG_FILE)
+        self.assertEqual(timings.DEFAULT_SECONDS, log.estimate('bin/exe.exe'))
+        log = timings.Log(timings.LOG_FILE)
+        log.record('obj/a.c.obj', ['cc'], 1.0)
+        log.record('obj/b.c.obj', ['cc'], 3.0)
+        log.record('bin/exe.exe', ['ld'], 10.0)
+        self.assertEqual(2.0, log.estimate('obj/c.c.obj'))
+        self.assertEqual(14.0 / 3, log.estimate('lib/thing.so'))
+
+    def test_otherCommandIsEstimatedByExtension(self):
+        log = timings.Log(timings.LOG_FILE)
+        log.record('obj/a.c.obj', ['cc', '-O0'], 1.0)
+        log.record('obj/b.c.obj', ['cc', '-O0'], 3.0)
+        self.assertEqual(1.0, log.estimate('obj/a.c.obj', ['cc', '-O0']))
+        self.assertEqual(2.0, log.estimate('obj/a.c.obj', ['cc', '-O3']))
+
+    def test_compacted(self):
+        log = timings.Log(timings.LOG_FILE)
+        for index in range(timings._COMPACT_SLACK + 10):
+            log.record('obj/a.c.obj', ['cc'], float(index))
+        log.save()
+        log = timings.Log(timings.LOG_FILE)
+        self.assertEqual(timings._COMPACT_SLACK + 9, log.duration('obj/a.c.obj'))
+        with open(timings.LOG_FILE) as stream:
+            self.assertEqual(1, len(stream.readlines()))
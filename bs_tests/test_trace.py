@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from bs import scheduler
+from bs import trace
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        del trace._events[:]
+        trace.ENABLED = True
+
+    def tearDown(self):
+        trace.ENABLED = False
+        del trace._events[:]
+        shutil.rmtree(self.tmp)
+
+    def test_commandSpanHasResourceUsage(self):
+        self.assertTrue(scheduler.call([sys.executable, '-c', 'pass']))
+        event, = trace._events
+        self.assertEqual('command', event['cat'])
+        self.assertEqual('X', event['ph'])
+        if hasattr(os, 'wait4'):
+            self.assertIn('max_rss_kb', event['args'])
+            self.assertIn('user_cpu_s', event['args'])
+            self.assertIn('system_cpu_s', event['args'])
+
+    def test_failedCommand(self):
+        self.assertFalse(scheduler.call([sys.executable, '-c', 'import sys; sys.exit(3)']))
+
+    def test_save(self):
+        with trace.span('outer'):
+            pass
+        path = os.path.join(self.tmp, 'trace.json')
+        trace.save(path)
+        with open(path) as stream:
+            events = json.load(stream)['traceEvents']
+        self.assertIn('outer', [event['name'] for event in events])
+        self.assertIn('thread_name', [event['name'] for event in events])
+
+    def test_usageIsPerCommand(self):
+        busy = 'import time\nend = time.process_time() + 0.3\nwhile time.process_time() < end: pass'
+        self.assertTrue(scheduler.call([sys.executable, '-c', busy]))
+        self.assertTrue(scheduler.call([sys.executable, '-c', 'pass']))
+        if hasattr(os, 'wait4'):
+            busy_args, idle_args = [event['args'] for event in trace._events]
+            self.assertGreater(busy_args['user_cpu_s'] + busy_args['system_cpu_s'], 0.25)
+            self.assertLess(idle_args['user_cpu_s'] + idle_args['system_cpu_s'], 0.25)
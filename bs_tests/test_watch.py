@@ -0,0 +1,119 @@
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import bs
+from bs import graph
+from bs import scheduler
+from bs import state
+from bs import timings
+from bs import watch
+
+
+class ConcurrencyRunner(object):
+    '''Writes the output of an objective, counting how many commands are running at the same time'''
+
+    pool = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+
+    def batch_key(self, item):
+        return None
+
+    def command_for(self, item):
+        return [sys.executable, '-c', 'import sys, time; time.sleep(0.05); open(sys.argv[1], "w").close()',
+                item.output]
+
+    def execute(self, item, command):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        try:
+            return scheduler.call(command)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def finish(self, item):
+        pass
+
+
+class TestPollingWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'a.c')
+        open(self.path, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_changedFile(self):
+        watcher = watch.PollingWatcher(interval=0.01)
+        watcher.watch([self.path])
+        self.assertEqual(set(), watcher.wait(0))
+        with open(self.path, 'w') as stream:
+            stream.write('int a;\n')
+        self.assertEqual(set([self.path]), watcher.wait(1))
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        graph.reset()
+
+    def test_affectedIncludesDownstream(self):
+        lib = bs.StaticLibrary('lib', 'a.c', 'b.c')
+        exe = bs.Executable('exe', lib, 'main.c')
+        for item in [lib[0], lib[1], lib, exe[1], exe]:
+            graph.current.runners[graph.current.add(item)] = None
+        index = watch._Index()
+        self.assertEqual(set(['a.c', 'b.c', 'main.c']), index.sources)
+        affected = [graph.current.nodes[node].output for node in index.affected(['a.c'])]
+        self.assertEqual(sorted([lib[0].output, lib.output, exe.output]), sorted(affected))
+
+
+class TestRebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        state.database = state.Database(state.STATE_FILE)
+        timings.log = timings.Log(timings.LOG_FILE)
+        bs.clear_stats()
+        graph.reset()
+        for name in ['a.c', 'b.c', 'c.c']:
+            open(name, 'w').close()
+        scheduler.JOBS = 4
+        del scheduler.failed[:]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+        scheduler.JOBS = 1
+        scheduler.POOLS.value = None
+        del scheduler.failed[:]
+
+    def test_poolIsKept(self):
+        scheduler.POOLS.value = ['heavy=1']
+        runner = ConcurrencyRunner()
+        objects = [bs.Object(name) for name in ['a.c', 'b.c', 'c.c']]
+        with scheduler.batch():
+            for obj in objects:
+                scheduler.schedule(obj, runner, 'heavy')
+        self.assertEqual(1, runner.most)
+        runner.most = 0
+        for obj in objects:
+            os.remove(obj.output)
+            bs.invalidate(obj.output)
+        watch.Watch()._rebuild([graph.current.add(obj) for obj in objects])
+        self.assertEqual(1, runner.most)
+        self.assertTrue(all(os.path.exists(obj.output) for obj in objects))